@@ -0,0 +1,337 @@
+# Copyright Petras Jokubauskas 2016
+"""Benchmarks of Cam-overlap-manager hot paths: parsing, aggregation,
+indexing, filtering and saving of overlap files, run on the synthetic
+Quanti tree (see cameca_synth) or on the given one. The results are
+printed as JSON, so that they can be stored and compared across
+releases.
+
+examples:
+  python CamOverlapBench.py --files 1000 --entries 50 -o results.json
+  python CamOverlapBench.py --tree Quanti aggregate filtering
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from glob import glob
+from statistics import median
+
+import cameca
+import cameca_synth
+from cameca import (CamecaOverlap, CamecaQtiSetup, OverlapIndex,
+                    OverlapLibrary, OverlapWriter, QtiSetupCatalogue,
+                    iter_overlaps, parse_overlap_files, sweep_overlap_dir)
+
+logger = logging.getLogger('CamOverlapBench')
+
+# name: function preparing the bench and returning timed callable,
+# which returns the number of processed items:
+scenarios = {}
+
+
+class Skipped(Exception):
+    """raised by scenario which can not run in this environment"""
+
+
+def scenario(function):
+    scenarios[function.__name__] = function
+    return function
+
+
+class Bench(object):
+    """the Quanti tree with its overlaps parsed on demand"""
+
+    def __init__(self, root, workdir, synthetic=True):
+        self.root = root
+        self.workdir = workdir
+        # files of synthetic tree can be modified by the scenarios:
+        self.synthetic = synthetic
+        self.overlap_dir = os.path.join(root, 'Overlap')
+        self.ovl_paths = sorted(glob(os.path.join(self.overlap_dir,
+                                                  '*.ovl')))
+        self.qti_paths = sorted(glob(os.path.join(root, '*.qtiSet')))
+        self._parsed = None
+        self._library = None
+
+    @property
+    def parsed(self):
+        if self._parsed is None:
+            self._parsed = [CamecaOverlap(i) for i in self.ovl_paths]
+        return self._parsed
+
+    @property
+    def library(self):
+        if self._library is None:
+            self._library = OverlapLibrary(self.overlap_dir)
+            self._library.update()
+        return self._library
+
+
+@scenario
+def parse_ovl(bench):
+    def run():
+        for path in bench.ovl_paths:
+            CamecaOverlap(path)
+        return len(bench.ovl_paths)
+    return run
+
+
+@scenario
+def parse_ovl_parallel(bench):
+    def run():
+        parse_overlap_files(bench.ovl_paths)
+        return len(bench.ovl_paths)
+    return run
+
+
+@scenario
+def stream_ovl(bench):
+    def run():
+        return sum(1 for path in bench.ovl_paths
+                   for item in iter_overlaps(path))
+    return run
+
+
+@scenario
+def parse_qti(bench):
+    def run():
+        for path in bench.qti_paths:
+            CamecaQtiSetup(path)
+        return len(bench.qti_paths)
+    return run
+
+
+@scenario
+def aggregate(bench):
+    overlaps = [i for cam_overlap in bench.parsed
+                for i in cam_overlap.overlaps]
+
+    def run():
+        aggregate = CamecaOverlap()
+        for item in overlaps:
+            aggregate.append_unique_overlap(item.copy())
+        return len(overlaps)
+    return run
+
+
+@scenario
+def library_update(bench):
+    def run():
+        OverlapLibrary(bench.overlap_dir).update()
+        return len(bench.ovl_paths)
+    return run
+
+
+@scenario
+def library_incremental(bench):
+    """update of the library after one percent of files got touched"""
+    if not bench.synthetic:
+        raise Skipped('it would touch the files of the given tree')
+    library = bench.library
+    touched = bench.ovl_paths[::100]
+
+    def run():
+        for path in touched:
+            os.utime(path)
+        library.update()
+        return len(touched)
+    return run
+
+
+@scenario
+def index_build(bench):
+    overlaps = bench.library.aggregate.overlaps
+
+    def run():
+        OverlapIndex(overlaps)
+        return len(overlaps)
+    return run
+
+
+@scenario
+def index_query(bench):
+    index = bench.library.index
+    queries = [{'atom': atom, 'spect_nr': 3} for atom in range(3, 93)] +\
+        [{'atom_line': (atom, 2), 'xtal': 'LIF'} for atom in range(3, 93)]
+
+    def run():
+        for criteria in queries:
+            index.rows(**criteria)
+        return len(queries)
+    return run
+
+
+@scenario
+def filtering(bench):
+    """CascadingFilterModel refiltering of the columnar library model"""
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from PyQt5 import QtCore
+        import CamOverlapManager_v2 as manager
+    except ImportError as e:
+        raise Skipped(str(e))
+    if QtCore.QCoreApplication.instance() is None:
+        bench.qt_app = QtCore.QCoreApplication([])
+    library = bench.library
+    model = manager.OverlapFileModel()
+    model.set_cameca_overlap(library.aggregate, columnar=True,
+                             index=library.index.copy())
+    proxy = manager.CascadingFilterModel()
+    proxy.set_original_model(model)
+    selections = [['Fe'], ['Fe', 'Mg', 'Si'], ['Ti', 'V', 'Cr', 'Mn'], []]
+
+    def run():
+        for elements in selections:
+            proxy.setMeasuredElementFilter(elements)
+            proxy.rowCount()
+        return len(selections)
+    return run
+
+
+@scenario
+def save_atomic(bench):
+    cam_overlap = bench.library.snapshot()
+    cam_overlap.filename = os.path.join(bench.workdir, 'save.ovl')
+
+    def run():
+        cam_overlap.save_to_file()
+        return cam_overlap.n_overlaps
+    return run
+
+
+@scenario
+def save_stream(bench):
+    overlaps = bench.library.aggregate.overlaps
+    filename = os.path.join(bench.workdir, 'stream.ovl')
+
+    def run():
+        with OverlapWriter(filename) as writer:
+            for item in overlaps:
+                writer.write(item)
+        return len(overlaps)
+    return run
+
+
+@scenario
+def catalogue(bench):
+    def run():
+        QtiSetupCatalogue(bench.root).update()
+        return len(bench.qti_paths)
+    return run
+
+
+@scenario
+def sweep(bench):
+    def run():
+        sweep_overlap_dir(bench.root)
+        return len(bench.ovl_paths)
+    return run
+
+
+def run_scenario(name, bench, repeat):
+    result = {'name': name}
+    try:
+        run = scenarios[name](bench)
+    except Skipped as e:
+        logger.warning('{0} skipped: {1}'.format(name, e))
+        result['skipped'] = str(e)
+        return result
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        count = run()
+        times.append(time.perf_counter() - start)
+    result.update({'count': count,
+                   'times': times,
+                   'min': min(times),
+                   'median': median(times),
+                   'per_item_us': min(times) / max(count, 1) * 1e6})
+    logger.info('{0}: {1:.4f} s ({2:.2f} us per item)'.format(
+        name, result['min'], result['per_item_us']))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('scenarios', nargs='*', metavar='SCENARIO',
+                        help='scenarios to run (default: all of {0})'.format(
+                            ', '.join(scenarios)))
+    parser.add_argument('--tree', metavar='DIR',
+                        help='benchmark on existing Quanti tree instead '
+                             'of the synthetic one')
+    parser.add_argument('--files', type=int, default=200,
+                        help='number of synthetic setups (default: 200)')
+    parser.add_argument('--entries', type=int, default=30,
+                        help='overlaps per synthetic file (default: 30)')
+    parser.add_argument('--file-version', default='mixed',
+                        choices=['3', '4', 'mixed'],
+                        help='version of synthetic files (default: mixed)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='timed runs per scenario (default: 5)')
+    parser.add_argument('-o', '--output', help='JSON file to write '
+                                               '(default: stdout)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='report timings while running')
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.INFO)
+    for name in args.scenarios:
+        if name not in scenarios:
+            parser.error('unknown scenario ' + name)
+    selected = args.scenarios or list(scenarios)
+
+    workdir = tempfile.mkdtemp(prefix='cam-overlap-bench-')
+    try:
+        if args.tree is None:
+            root = os.path.join(workdir, 'Quanti')
+            if args.file_version == 'mixed':
+                versions = (3, 4)
+            else:
+                versions = (int(args.file_version),)
+            start = time.perf_counter()
+            cameca_synth.generate_tree(root, args.files, args.entries,
+                                       versions=versions, seed=args.seed)
+            logger.info('synthetic tree written in {0:.2f} s'.format(
+                time.perf_counter() - start))
+        else:
+            root = args.tree
+        bench = Bench(root, workdir, synthetic=args.tree is None)
+        results = [run_scenario(name, bench, args.repeat)
+                   for name in selected]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'date': datetime.now().isoformat(timespec='seconds'),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'parse_workers': cameca.parse_workers,
+              'tree': args.tree,
+              'files': len(bench.ovl_paths),
+              'setups': len(bench.qti_paths),
+              'entries': args.entries if args.tree is None else None,
+              'file_version': args.file_version,
+              'seed': args.seed,
+              'repeat': args.repeat,
+              'results': results}
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+    else:
+        with open(args.output, 'w') as fn:
+            json.dump(report, fn, indent=1)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
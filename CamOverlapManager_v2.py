@@ -1,16 +1,17 @@
 # Copyright Petras Jokubauskas 2016
 
-import struct
-from io import BytesIO
 from PyQt5 import QtWidgets, QtCore, QtGui
 import logging
-from glob import glob
-from operator import itemgetter
+from functools import partial
 
 from datetime import datetime, timedelta
 import os
 import sys
-import time
+
+# Qt independent core:
+from cameca import (CamecaBase, CamecaQtiSetup, CamecaOverlap,
+                    OverlapColumns, OverlapIndex, OverlapLibrary, get_xtal,
+                    html_colorify, parse_errors, qtiSet_path)
 
 # GUIelements:
 from GUI.mainwindow2 import Ui_MainWindow
@@ -19,49 +20,31 @@ from GUI import element_table_Qt5 as et
 version = '0.9.0'
 
 program_path = os.path.dirname(__file__)
-if os.name == 'nt':
-    import winreg
-    try:
-        with winreg.OpenKey(winreg.HKEY_CURRENT_USER,
-                            r"SOFTWARE\Cameca\SX\Configuration") as thingy:
-            data_path = winreg.QueryValueEx(thingy, "DataPath")[0]
-        qtiSet_path = os.path.join(data_path, 'Analysis Setups', 'Quanti')
-    except EnvironmentError:
-        logging.warning(
-            'Cameca PeakSight sotware were not dected on the system')
-
-# for development and debugging on linux/bsd:
-elif os.name == 'posix':
-    # the path with sample qtiSet files
-    qtiSet_path = 'Quanti'
+
+# present the library through the columnar copy (see OverlapColumns):
+columnar_library = True
+# number of library rows presented at once to the view:
+library_fetch_batch = 512
+# milliseconds without file changes before the refresh is done:
+refresh_quiet_period = 500
+# first delay and deadline (milliseconds) of retrying to read locked qtiSet:
+qti_retry_delay = 100
+qti_retry_deadline = 5000
+# number of rotated backups (.ovl.bak1, .ovl.bak2 ...) kept at saving:
+overlap_backups = 0
 
 with open(os.path.join(program_path, 'about.html'), 'r') as about_html:
     about_text = about_html.read()
 
 
-# handy functions:
-def filetime_to_datetime(filetime):
-    """Return recalculated lame windows filetime
-    to usable python (unix) datetime."""
-    return datetime(1601, 1, 1) + timedelta(microseconds=filetime / 10)
-
-
-def mod_date(filename):
-    """Return datetime of file's last modification"""
-    t = os.path.getmtime(filename)
-    return datetime.fromtimestamp(t)
-
-
 # define warning messages once:
 the_root_of_all_evil = 'MS Windows is OS designed by loosers '\
                        'for loosers - it just succesfully wasted '\
                        'again another 100 ms of your time!;'
 ms_stinks = 'MS Windows sucks... not releasing lock of file for more'\
-            'than 5000 millseconds. Giving up of refreshing qtiSet file.'
-
-
-def html_colorify(string, color):
-    return r'<font color="{1}">{0}<\font>'.format(string, color)
+            ' than {0} millseconds. Giving up of refreshing qtiSet file.'
+half_written = 'qtiSet file could not be parsed ({0}) for more than {1}'\
+               ' millseconds. Giving up of refreshing qtiSet file.'
 
 
 cameca_colors = {'PC0': QtGui.QColor(182, 255, 182),
@@ -71,336 +54,91 @@ cameca_colors = {'PC0': QtGui.QColor(182, 255, 182),
                  'PET': QtGui.QColor(192, 192, 255),
                  'TAP': QtGui.QColor(175, 255, 255),
                  'LIF': QtGui.QColor(255, 192, 255)}
+black = QtGui.QColor(0, 0, 0)
+# role of the values by which the library view is sorted:
+sort_role = QtCore.Qt.UserRole
+# marks display value which is not computed yet:
+_not_cached = object()
+
+
+class LibraryScanner(QtCore.QObject):
+    """worker updating the OverlapLibrary in the background thread.
+    Every scan request carries the generation number; setting
+    the generation attribute to the newer one cancels the running
+    scan (at the next batch of files)."""
+    # generation, list of OverlapItem copies:
+    batchReady = QtCore.pyqtSignal(int, list)
+    # generation, parsed files, files to parse:
+    progress = QtCore.pyqtSignal(int, int, int)
+    # path, error message:
+    fileError = QtCore.pyqtSignal(str, str)
+    # generation, (CamecaOverlap, OverlapColumns or None, OverlapIndex,
+    # library changes counter) to be presented or None if the presented
+    # model is up to date:
+    finished = QtCore.pyqtSignal(int, object)
+    # generation, presentation (as with finished) of the library restored
+    # from the cache, emitted before the update of it:
+    cacheLoaded = QtCore.pyqtSignal(int, object)
 
-
-def get_xtal(full_xtal_name):
-    """get basic crystal name.
-       example: get_xtal('LLIF') -> 'LIF'
-    """
-    for i in ['PC0', 'PC1', 'PC2', 'PC3', 'PET', 'TAP', 'LIF']:
-        if i in full_xtal_name:
-            return i
-
-
-class CamecaBase(object):
-    """base class with cameca data type translating methods
-    and cameca file header reader method useful
-    for any other derived Reader/Writer class"""
-
-    value_map = {
-                 1: 'WDS setup',
-                 2: 'Image/maping setup',
-                 3: 'Calibration setup',
-                 4: 'Quanti setup',
-                 5: 'unknown',  # What is this???
-                 6: 'WDS results',
-                 7: 'Image/maping results',
-                 8: 'Calibration results',
-                 9: 'Quanti results',
-                 10: 'Peak overlap table'
-                }
-    cameca_lines = {
-                    1: 'Kβ', 2: 'Kα',
-                    3: 'Lγ4', 4: 'Lγ3', 5: 'Lγ2', 6: 'Lγ',
-                    7: 'Lβ9', 8: 'Lβ10', 9: 'Lβ7', 10: 'Lβ2',
-                    11: 'Lβ6', 12: 'Lβ3', 13: 'Lβ4', 14: 'Lβ',
-                    15: 'Lα', 16: 'Lν', 17: 'Ll',
-                    18: 'Mγ', 19: 'Mβ', 20: 'Mα', 21: 'Mζ', 22: 'Mζ2',
-                    23: 'M1N2', 24: 'M1N3', 25: 'M2N1', 26: 'M2N4',
-                    27: 'M2O4', 28: 'M3N1', 29: 'M3N4', 30: 'M3O1',
-                    31: 'M3O4', 32: 'M4O2'
-                   }
-
-    element_table = {
-                     0: 'n', 1: 'H', 2: 'He', 3: 'Li', 4: 'Be', 5: 'B',
-                     6: 'C', 7: 'N', 8: 'O', 9: 'F', 10: 'Ne', 11: 'Na',
-                     12: 'Mg', 13: 'Al', 14: 'Si', 15: 'P', 16: 'S',
-                     17: 'Cl', 18: 'Ar', 19: 'K', 20: 'Ca', 21: 'Sc',
-                     22: 'Ti', 23: 'V', 24: 'Cr', 25: 'Mn', 26: 'Fe',
-                     27: 'Co', 28: 'Ni', 29: 'Cu', 30: 'Zn', 31: 'Ga',
-                     32: 'Ge', 33: 'As', 34: 'Se', 35: 'Br', 36: 'Kr',
-                     37: 'Rb', 38: 'Sr', 39: 'Y', 40: 'Zr', 41: 'Nb',
-                     42: 'Mo', 43: 'Tc', 44: 'Ru', 45: 'Rh', 46: 'Pd',
-                     47: 'Ag', 48: 'Cd', 49: 'In', 50: 'Sn', 51: 'Sb',
-                     52: 'Te', 53: 'I', 54: 'Xe', 55: 'Cs', 56: 'Ba',
-                     57: 'La', 58: 'Ce', 59: 'Pr', 60: 'Nd', 61: 'Pm',
-                     62: 'Sm', 63: 'Eu', 64: 'Gd', 65: 'Tb', 66: 'Dy',
-                     67: 'Ho', 68: 'Er', 69: 'Tm', 70: 'Yb', 71: 'Lu',
-                     72: 'Hf', 73: 'Ta', 74: 'W', 75: 'Re', 76: 'Os',
-                     77: 'Ir', 78: 'Pt', 79: 'Au', 80: 'Hg', 81: 'Tl',
-                     82: 'Pb', 83: 'Bi', 84: 'Po', 85: 'At', 86: 'Rn',
-                     87: 'Fr', 88: 'Ra', 89: 'Ac', 90: 'Th', 91: 'Pa',
-                     92: 'U', 93: 'Np', 94: 'Pu', 95: 'Am', 96: 'Cm',
-                     97: 'Bk', 98: 'Cf', 99: 'Es', 100: 'Fm', 101: 'Md',
-                     102: 'No', 103: 'Lr'
-                    }
-
-    @classmethod
-    def to_type(cls, sx_type):
-        """return the string representation of cameca file type
-        from given integer code"""
-        return cls.value_map[sx_type]
-
-    @classmethod
-    def to_element(cls, number):
-        """return atom name for given atom number"""
-        return cls.element_table[number]
-
-    @classmethod
-    def to_line(cls, number):
-        """ return stringof x-ray line from given cameca int code"""
-        return cls.cameca_lines[number]
-
-    def _read_the_header(self, fbio):
-        """parse the header data into base cameca object atributes
-        arguments:
-        fbio -- file BytesIO object or the opened file
-        """
-        fbio.seek(0)
-        a, b, c, d = struct.unpack('<B3sii', fbio.read(12))
-        if b != b'fxs':
-            raise IOError('The file is not a cameca peaksight software file')
-        self.cameca_bin_file_type = a
-        self.file_type = self.to_type(a)
-        self.file_version = c
-        self.file_comment = fbio.read(d).decode()
-        fbio.seek(0x1C, 1)  # some spacer with unknown values
-        n_changes = struct.unpack('<i', fbio.read(4))[0]
-        self.changes = []
-        for i in range(n_changes):
-            filetime, change_len = struct.unpack('<Qi', fbio.read(12))
-            comment = fbio.read(change_len).decode()
-            self.changes.append([filetime_to_datetime(filetime),
-                                 comment])
-        if self.file_version == 4:
-            fbio.seek(0x08, 1)
-
-
-class CamecaQtiSetup(CamecaBase):
-    def __init__(self, filename):
-        self.parse_thing(filename)
-
-    def brute_force_refresh(self):
-        time.sleep(0.1)
-        self.try_time += 0.1
-        logging.warning(html_colorify(the_root_of_all_evil, 'yellow'))
-        if (self.try_time > 5):
-            logging.warning(html_colorify(ms_stinks, 'red'))
-        try:
-            self.parse_thing(self.filename)
-        except PermissionError:
-            self.brute_force_refresh()
-
-    def refresh(self):
-        if os.path.isfile(self.filename):
-            if mod_date(self.filename) != self.file_modification_date:
-                warnung = ".".join([self.file_basename,
-                                    "qtiSet got changed",
-                                    " trying to refresh..."])
-                logging.warning(html_colorify(warnung, 'yellow'))
-                self.try_time = 0
-                try:
-                    self.parse_thing(self.filename)
-                except PermissionError:
-                    self.brute_force_refresh()
-        else:
-            warnung = ".".join([self.file_basename,
-                                "qtiSet got removed",
-                                " The ovl file is orphaned."])
-            logging.warning(html_colorify(warnung, 'yellow'))
-
-    def parse_thing(self, filename):
-        self.filename = filename
-        with open(filename, 'br') as fn:
-            # file bytes
-            fbio = BytesIO()
-            fbio.write(fn.read())
-        self.file_basename = os.path.basename(filename).rsplit('.', 1)[0]
-        self.file_modification_date = mod_date(filename)
-        self._read_the_header(fbio)
-        if self.cameca_bin_file_type != 4:
-            raise IOError(' '.join(['The file header shows it is not qtiSet',
-                                    'file, but', self.file_type]))
-        # parse data:
-        fbio.seek(12, 1)  # unknown shit
-        self.n_options = struct.unpack('<i', fbio.read(4))[0]
-        self.fingerprints = []
-        self.options = {}
-        for i in range(self.n_options):
-            fbio.seek(32, 1)  # skip another junk
-            field_names = ['heat', 'HV', 'unkn1',
-                           'Xhi', 'Yhi', 'Xlo',
-                           'Ylo', 'apert_X', 'apert_Y', 'C1',
-                           'C2', 'unkn2', 'current',
-                           'BFocus', 'unkn3', 'unkn4', 'BFocus2',
-                           'size', 'asti_amp', 'asti_deg']
-            field_values = struct.unpack('<20i', fbio.read(80))
-            self.options[i] = dict(zip(field_names, field_values))
-            fbio.seek(424, 1)  # skip not so relevant information and junk
-            elements = struct.unpack('<i', fbio.read(4))[0]
-            for j in range(elements):
-                # field_names2 = ['atom', 'line', 'spect no', 'xtal','2d','K']
-                # field_values2 = struct.unpack('<3i4s2f', fbio.read(24))
-                # fingerprint = fbio.read(16) # get binary fingerprint
-                self.fingerprints.append(fbio.read(16))
-                # thingy = (dict(zip(field_names2, field_values2)))
-                fbio.seek(8, 1)
-                str_len = struct.unpack('<i', fbio.read(4))[0]
-                fbio.seek(420 + str_len, 1)  # skip irrelevant shit
-                if self.file_version == 4:
-                    fbio.seek(4, 1)
-
-
-class CamecaOverlap(CamecaBase):
-    def __init__(self, filename=None):
-        self.filename = filename
-        if filename is None:
-            self.n_overlaps = 0
-            self.overlaps = []
-        elif os.path.exists(filename):
-            logging.info(filename + 'exists. Opening...')
-            with open(filename, 'br') as fn:
-                # file bytes:
-                self.fbio = BytesIO()
-                self.fbio.write(fn.read())
-            self.file_basename = os.path.basename(filename).rsplit('.', 1)[0]
-            self.file_modification_date = mod_date(filename)
-            self._read_the_header(self.fbio)
-            if self.cameca_bin_file_type != 10:
-                raise IOError(' '.join(['The file header shows it is not',
-                                        'overlap file, but',
-                                        self.file_type]))
-            data_type, self.n_overlaps = struct.unpack('<2i',
-                                                       self.fbio.read(8))
-            if data_type != 0:
-                raise RuntimeError(' '.join(['unexpected value of overlap',
-                                             'struct: instead of expected',
-                                             '0, the value',
-                                             str(data_type),
-                                             'at the address',
-                                             str(self.fbio.tell())]))
-            self.overlaps = []
-            for i in range(self.n_overlaps):
-                item = OverlapItem(self.fbio)
-                item.append_metadata([self.file_modification_date,
-                                      self.file_basename])
-                self.overlaps.append(item)
-        else:
-            logging.info(filename +
-                         'does not exists. Creating new Overlap set...')
-            self.file_comment = ''
-            self.n_overlaps = 0
-            self.overlaps = []
-
-    def insert_overlap(self, index, overlap):
-        self.overlaps.insert(index, overlap)
-        self.n_overlaps += 1
-
-    def remove_overlap(self, index):
-        del self.overlaps[index]
-        self.n_overlaps -= 1
-
-    def append_unique_overlap(self, overlap):
-        if overlap in self.overlaps:
-            item = self.overlaps[self.overlaps.index(overlap)]
-            item.append_metadata(overlap.metadata[0])
+    def __init__(self):
+        super().__init__()
+        self.generation = 0
+        # library changes counter (see OverlapLibrary.changes) of
+        # the presented model, set by GUI thread at model swapping:
+        self.presented_changes = -1
+
+    def scan(self, generation, library, fingerprints, batches):
+        """update the library; if batches is True (first load) the
+        library restored from the cache is emitted at once with
+        cacheLoaded and the newly parsed overlaps in batches"""
+        if generation != self.generation:
+            self.finished.emit(generation, None)
+            return
+        batch_callback = None
+        if batches:
+            # the restored library is presented as it is only if the
+            # update would not rebuild it for the fingerprints filter:
+            if (library.files == {}) and library.load_cache() and\
+                    (fingerprints is None):
+                self.cacheLoaded.emit(generation,
+                                      self._presentation(library))
+            batch_callback = partial(self._emit_batch, generation)
+        library.update(
+            fingerprints, batch_callback=batch_callback,
+            progress_callback=lambda done, total: self.progress.emit(
+                generation, done, total),
+            error_callback=lambda path, e: self.fileError.emit(path,
+                                                               str(e)),
+            cancelled=lambda: generation != self.generation)
+        if generation != self.generation:
+            # superseded; the changes are kept unpresented and unsaved
+            # in the library counters for the newer scan:
+            self.finished.emit(generation, None)
+            return
+        if library.file_changes != library.saved_changes:
+            library.save_cache()
+        presentation = None
+        if library.changes != self.presented_changes:
+            presentation = self._presentation(library)
+        self.finished.emit(generation, presentation)
+
+    def _presentation(self, library):
+        """build the objects of the model presenting the library here,
+        so that the GUI thread only swaps them in"""
+        if columnar_library:
+            # the rows are served from the columns:
+            cam_overlaps = CamecaOverlap()
+            columns = OverlapColumns(library.aggregate.overlaps)
         else:
-            self.overlaps.append(overlap)
-            self.n_overlaps += 1
+            cam_overlaps = library.snapshot()
+            columns = None
+        # index copy, as the scanner patches the library one:
+        return cam_overlaps, columns, library.index.copy(), library.changes
 
-    def _initiate_with_header(self, version=3, changes=''):
-        """
-        create and return BytesIO stream initiated with given header
-        information.
-        fyle_type -- coded int value of cameca file/data type
-        version -- version of the file (default 3)
-        comment -- string with comment of file (default empty string)
-        changes -- default is empty string (is not going to be implimented)
-        """
-        fbio = BytesIO()
-        comment = self.file_comment
-        fbio.write(struct.pack('<B3sii', 10, b'fxs',
-                               version, len(comment.encode())))
-        pack_str = ''.join(['<', str(len(comment.encode())), 's'])
-        fbio.write(struct.pack(pack_str, comment.encode()))
-        fbio.write(0x1C * b'\x00')
-        pack_str = ''.join(['<i', str(len(changes.encode())), 's'])
-        fbio.write(struct.pack(pack_str, len(changes), changes.encode()))
-        if version == 4:
-            fbio.write(0x08 * b'\x00')
-        return fbio
-
-    def save_to_file(self, version=3):
-        self.fbio = self._initiate_with_header(version=version)
-        self.fbio.write(struct.pack('<2i', 0, self.n_overlaps))
-        for i in self.overlaps:
-            self.fbio.write(i.raw_str)
-        self.fbio.seek(0)
-        with open(self.filename, 'bw') as fn:
-            # file bytes
-            fn.write(self.fbio.read())
-
-
-class OverlapItem(object):
-    def __init__(self, fbio):
-        # we save raw string because we have few unknown values
-        # this makes the saving of overlap information less demanding:
-        if type(fbio) == BytesIO:
-            self.raw_str = fbio.read(44)
-            self._first_initiate()
-            std_name = fbio.read(self.str_len)
-            self.raw_str += std_name
-            spect = fbio.read(12)
-            self.raw_str += spect
-            self.unknown1, self.spect_nr, self.spect_name = struct.unpack(
-                '<2i4s', spect)
-            if self.struct_type == 3:  # only version 3
-                the_rest = fbio.read(8)
-                self.raw_str += the_rest
-                self.dwelltime, self.unknown2 = struct.unpack('<fi', the_rest)
-        elif type(fbio) == bytes:
-            self.raw_str = fbio
-            self._first_initiate()
-            i = 44 + self.str_len
-            std_name = fbio[44:i]
-            self.unknown1, self.spect_nr, self.spect_name = struct.unpack(
-                '<2i4s', fbio[i:i+12])
-            if self.struct_type == 3:  # only version 3
-                self.dwelltime, self.unknown2 = struct.unpack('<fi',
-                                                              fbio[i+12:i+20])
-        self.std_name = std_name.decode()
-        self.fingerprint = struct.pack('<3i4s', self.atom, self.line,
-                                       self.spect_nr, self.spect_name)
-        self.metadata = []
-        self.n_metadata = 0
-
-    def _first_initiate(self):
-        self.struct_type, self.atom, self.line, self.i_atom,\
-            self.i_line, self.order, self.offset, self.HV, self.beam_cur,\
-            self.peak_bkd, self.str_len = struct.unpack('<7i3fi',
-                                                        self.raw_str[:44])
-
-    def __repr__(self):
-        return ' '.join([CamecaBase.to_element(self.i_atom),
-                         CamecaBase.to_line(self.i_line),
-                         'overlap with',
-                         CamecaBase.to_element(self.atom),
-                         CamecaBase.to_line(self.line)])
-
-    def __eq__(self, other):
-        return self.raw_str == other.raw_str
-
-    def append_metadata(self, metadata=[]):
-        self.metadata.append(metadata)
-        self.n_metadata += 1
-        self.metadata.sort(key=itemgetter(0))
-        self.oldest = self.metadata[0][0]
-
-    def oldest_newest(self):
-        old_n_new = [self.metadata[0], self.metadata[-1]]
-        a, b, c, d = [item for sublist in old_n_new for item in sublist]
-        thingy = 'oldest: {0} {1}\nnewest: {2} {3}'.format(a, b, c, d)
-        return thingy
+    def _emit_batch(self, generation, overlaps):
+        # copies, as the metadata of the originals keep changing
+        # in this thread while GUI thread would read them:
+        self.batchReady.emit(generation, [i.copy() for i in overlaps])
 
 
 class OverlapFileModel(QtCore.QAbstractTableModel, CamecaBase):
@@ -424,21 +162,74 @@ class OverlapFileModel(QtCore.QAbstractTableModel, CamecaBase):
                                   "crystal type",
                                   "dwell time (seconds)"]
 
-    def __init__(self):
+    def __init__(self, fetch_batch=0):
+        """fetch_batch -- if positive, rows are presented lazily by
+        batches of such size when view asks for more (default 0 - all
+        rows are presented at once)"""
         super().__init__()
         self.cam_overlaps = None
+        # optional read only columnar representation of cam_overlaps:
+        self.columns = None
+        self.fetch_batch = fetch_batch
+        # number of rows presented to the views:
+        self._n_rows = 0
+        # {column: list of per row display values}, see _display_value:
+        self._display = {}
+        # optional OverlapIndex of the rows, used by the filter:
+        self.overlap_index = None
         self.modified = False
         self.parent = QtCore.QModelIndex()
 
     def columnCount(self, parent=QtCore.QModelIndex()):
         return 13
 
-    def rowCount(self, parent=QtCore.QModelIndex()):
-        if self.cam_overlaps is not None:
+    def _total_rows(self):
+        if self.columns is not None:
+            return len(self.columns)
+        elif self.cam_overlaps is not None:
             return len(self.cam_overlaps.overlaps)
         else:
             return 0
 
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return self._n_rows
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return self._n_rows < self._total_rows()
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        n = self._total_rows() - self._n_rows
+        if self.fetch_batch > 0:
+            n = min(n, self.fetch_batch)
+        if n <= 0:
+            return
+        self.beginInsertRows(self.parent, self._n_rows, self._n_rows + n - 1)
+        self._n_rows += n
+        self.endInsertRows()
+
+    def fetch_all(self):
+        """present all rows and stop fetching lazily (i.e. for sorting,
+        which would order only the rows fetched so far)"""
+        self.fetch_batch = 0
+        self.fetchMore()
+
+    def rows_appended(self, overlaps):
+        """append overlaps to the end of presented ones without
+        any checking (i.e. batches from the library loader)"""
+        if self.columns is not None:
+            for i in overlaps:
+                self.columns.append(i)
+        else:
+            self.cam_overlaps.overlaps.extend(overlaps)
+            self.cam_overlaps.n_overlaps += len(overlaps)
+        if self.overlap_index is not None:
+            self.overlap_index.extend(overlaps)
+        for cached in self._display.values():
+            cached.extend([_not_cached] * len(overlaps))
+        # fill the first screen, the rest is left for fetchMore:
+        if (self.fetch_batch <= 0) or (self._n_rows < self.fetch_batch):
+            self.fetchMore()
+
     def headerData(self, section, orientation, role):
         if orientation == QtCore.Qt.Horizontal:
             if role == QtCore.Qt.DisplayRole:
@@ -446,166 +237,380 @@ class OverlapFileModel(QtCore.QAbstractTableModel, CamecaBase):
             elif role == QtCore.Qt.ToolTipRole:
                 return self.horizontal_header_tooltips[section]
 
-    def set_cameca_overlap(self, overlaps):
+    def set_cameca_overlap(self, overlaps, columnar=False, index=None,
+                           columns=None):
+        """set the overlaps to be presented by the model.
+        overlaps -- CamecaOverlap object
+        columnar -- if True, the overlaps are copied into OverlapColumns
+                    and data is served from it; such model is read only
+                    (default False)
+        index -- OverlapIndex of the overlaps, which is then kept
+                 up to date with appended rows (default None)
+        columns -- OverlapColumns built beforehand (i.e. in the library
+                   scanner thread) to serve data from, as with columnar
+                   (default None)"""
         self.beginResetModel()
         self.cam_overlaps = overlaps
+        self.overlap_index = index
+        if columns is not None:
+            self.columns = columns
+        elif columnar:
+            self.columns = OverlapColumns(overlaps.overlaps)
+        else:
+            self.columns = None
+        self._display = {}
+        self._n_rows = self._total_rows()
+        if self.fetch_batch > 0:
+            self._n_rows = min(self._n_rows, self.fetch_batch)
         self.endResetModel()
         # at loading the new overlap file reset modified flag:
         self.modified = False
 
+    def _node(self, row):
+        if self.columns is not None:
+            return self.columns.row(row)
+        return self.cam_overlaps.overlaps[row]
+
+    # columns showing the node attribute as it is:
+    attribute_columns = {1: 'n_metadata', 4: 'order', 5: 'offset', 6: 'HV',
+                         7: 'beam_cur', 8: 'peak_bkd', 9: 'std_name',
+                         10: 'spect_nr'}
+    # OverlapColumns arrays serving the sort_role of the columns:
+    sort_arrays = {0: 'oldest_ts', 1: 'n_metadata', 4: 'order', 5: 'offset',
+                   6: 'HV', 7: 'beam_cur', 8: 'peak_bkd', 10: 'spect_nr'}
+
+    def _compute_value(self, row, column):
+        """return the display value of the column (13 stands for
+        the background color)"""
+        node = self._node(row)
+        if column in self.attribute_columns:
+            return getattr(node, self.attribute_columns[column])
+        if column == 0:
+            return QtCore.QDate(node.oldest)
+        if column == 2:
+            return ' '.join([self.to_element(node.atom),
+                             self.to_line(node.line)])
+        if column == 3:
+            return ' '.join([self.to_element(node.i_atom),
+                             self.to_line(node.i_line)])
+        if column == 11:
+            return node.spect_name.decode()[::-1]  # reversing the string
+        if column == 12:
+            if node.struct_type == 3:
+                return node.dwelltime
+            return None
+        return cameca_colors.get(get_xtal(node.spect_name.decode()[::-1]))
+
+    def _display_value(self, row, column):
+        """return the display value of the cell, computing and caching
+        it at first access; only the cells which are asked are cached,
+        per column"""
+        cached = self._display.get(column)
+        if cached is None:
+            cached = [_not_cached] * self._total_rows()
+            self._display[column] = cached
+        value = cached[row]
+        if value is _not_cached:
+            value = self._compute_value(row, column)
+            cached[row] = value
+        return value
+
     def data(self, index, role=QtCore.Qt.DisplayRole):
         if not index.isValid():
             return None
 
-        column = index.column()
-        node = self.cam_overlaps.overlaps[index.row()]
-
-        if role == QtCore.Qt.ToolTipRole and index.column() == 1:
-            return node.oldest_newest()
-
         if role == QtCore.Qt.DisplayRole:
-            if column == 0:
-                return QtCore.QDate(node.oldest)
-            if column == 1:
-                return node.n_metadata
-            if column == 2:
-                return ' '.join([self.to_element(node.atom),
-                                 self.to_line(node.line)])
-            elif column == 3:
-                return ' '.join([self.to_element(node.i_atom),
-                                 self.to_line(node.i_line)])
-            elif column == 4:
-                return node.order
-            elif column == 5:
-                return node.offset
-            elif column == 6:
-                return node.HV
-            elif column == 7:
-                return node.beam_cur
-            elif column == 8:
-                return node.peak_bkd
-            elif column == 9:
-                return node.std_name
-            elif column == 10:
-                return node.spect_nr
-            elif column == 11:
-                return node.spect_name.decode()[::-1]  # reversing the string
-            elif column == 12 and node.struct_type == 3:
-                return node.dwelltime
+            return self._display_value(index.row(), index.column())
+
+        if role == sort_role:
+            # numeric columns are sorted right from the arrays:
+            if (self.columns is not None) and\
+                    (index.column() in self.sort_arrays):
+                return getattr(self.columns,
+                               self.sort_arrays[index.column()])[index.row()]
+            return self._display_value(index.row(), index.column())
 
         if role == QtCore.Qt.BackgroundRole:
-            return cameca_colors[get_xtal(node.spect_name.decode()[::-1])]
+            return self._display_value(index.row(), 13)
 
         if role == QtCore.Qt.ForegroundRole:
-            return QtGui.QColor(0, 0, 0)
+            return black
+
+        if role == QtCore.Qt.ToolTipRole and index.column() == 1:
+            return self._node(index.row()).oldest_newest()
 
     def insertRows(self, position, rows=[]):
+        """insert overlaps at the position skipping those which are
+        already present or conflict (same fingerprint and overlapping
+        element) with present ones; all rows are classified in one pass
+        against the hashed index of the present overlaps and inserted
+        in a single block"""
+        present_raw = set()
+        present_keys = set()
         for i in self.cam_overlaps.overlaps:
-            for j in rows:
-                if i.raw_str == j.raw_str:
-                    logging.warning(html_colorify(
-                        ' '.join(['identical',
-                                  j.__repr__(),
-                                  'already presented. Skipping....']),
-                        'yellow'))
-                    rows.remove(j)
-                elif (i.fingerprint == j.fingerprint) and (i.i_atom ==
-                                                           j.i_atom):
-                    warnung = ' '.join(["You have to remove the present",
-                                        j.__repr__(),
-                                        "overlap before appending this one"])
-                    logging.warning(html_colorify(warnung, "red"))
-                    rows.remove(j)
-        if rows == []:
+            present_raw.add(i.raw_str)
+            present_keys.add((i.fingerprint, i.i_atom))
+        accepted = []
+        for j in rows:
+            if j.raw_str in present_raw:
+                logging.warning(html_colorify(
+                    ' '.join(['identical',
+                              j.__repr__(),
+                              'already presented. Skipping....']),
+                    'yellow'))
+            elif (j.fingerprint, j.i_atom) in present_keys:
+                warnung = ' '.join(["You have to remove the present",
+                                    j.__repr__(),
+                                    "overlap before appending this one"])
+                logging.warning(html_colorify(warnung, "red"))
+            else:
+                # rows later in the selection are checked against it too:
+                present_raw.add(j.raw_str)
+                present_keys.add((j.fingerprint, j.i_atom))
+                accepted.append(j)
+        if accepted == []:
             return False
-        self.beginInsertRows(self.parent, position, position + len(rows) - 1)
-        for i in range(len(rows)):
-            self.cam_overlaps.insert_overlap(position, rows[i])
-            logging.info(' '.join(['added', rows[i].__repr__()]))
+        self.beginInsertRows(self.parent, position,
+                             position + len(accepted) - 1)
+        self.cam_overlaps.insert_overlaps(position, accepted)
+        self.overlap_index = None  # not maintained for the inserted rows
+        for cached in self._display.values():
+            cached[position:position] = [_not_cached] * len(accepted)
+        self._n_rows += len(accepted)
+        for i in accepted:
+            logging.info(' '.join(['added', i.__repr__()]))
         self.endInsertRows()
         self.modified = True
         return True
 
     def deleteRows(self, rows=[]):
+        """remove given rows; they are coalesced into contiguous ranges,
+        and every range is removed (bottom up) and signalled at once,
+        so that views keep their scroll position and selection"""
         if rows == []:
             return False
-        self.beginResetModel()
-        rows.sort(reverse=True)
-        for i in rows:
-            self.cam_overlaps.remove_overlap(i)
-        self.endResetModel()
+        ranges = []  # [first, last]
+        for i in sorted(set(rows)):
+            if ranges and (ranges[-1][1] == i - 1):
+                ranges[-1][1] = i
+            else:
+                ranges.append([i, i])
+        for first, last in reversed(ranges):
+            self.beginRemoveRows(self.parent, first, last)
+            self.cam_overlaps.remove_overlaps(range(first, last + 1))
+            if self.overlap_index is not None:
+                self.overlap_index.remove_rows(range(first, last + 1))
+            for cached in self._display.values():
+                del cached[first:last + 1]
+            self._n_rows -= last - first + 1
+            self.endRemoveRows()
         self.modified = True
         return True
 
     def checkOverlapCover(self, fingerprints):
-        not_covered = []
-        for i in range(len(self.cam_overlaps.overlaps)):
-            if self.cam_overlaps.overlaps[i].fingerprint not in fingerprints:
-                not_covered.append(i)
-        return not_covered
+        """return the list of row indexes of overlaps which fingerprint
+        is not in fingerprints (preferably set, i.e. fingerprint_set
+        of CamecaQtiSetup)"""
+        return [i for i, item in enumerate(self.cam_overlaps.overlaps)
+                if item.fingerprint not in fingerprints]
+
+    def filter_fields(self):
+        """return sequences of atom, i_atom and oldest use timestamp
+        of all rows for filtering without going through data"""
+        if self.columns is not None:
+            return (self.columns.atom, self.columns.i_atom,
+                    self.columns.oldest_ts)
+        if self.cam_overlaps is None:
+            return [], [], []
+        overlaps = self.cam_overlaps.overlaps
+        return ([i.atom for i in overlaps],
+                [i.i_atom for i in overlaps],
+                [i.oldest.timestamp() for i in overlaps])
 
     def getNode(self, index):
         if index.isValid():
+            if self.columns is not None:
+                return self.columns.node(index.row())
             node = self.cam_overlaps.overlaps[index.row()]
             if node is not None:
                 return node
 
 
-class DateFilterProxyModel(QtCore.QSortFilterProxyModel):
-    """Proxy model which filters parent and children in the trees
-    depending from parent/children filter results"""
+class CascadingFilterModel(QtCore.QSortFilterProxyModel):
+    """Proxy model filtering overlaps by measured element, overlapping
+    element and minimum date. The predicates are evaluated as integer
+    set and range tests over atom, i_atom and oldest fields of the
+    source model in one pass into the row mask, which is then just
+    looked up by filterAcceptsRow (no display strings are built).
+    If the source model has the OverlapIndex, only the rows it returns
+    for the element sets are tested for the date."""
 
-    def setFilterMinimumDate(self, date):
-        self._minDate = date
-        self.invalidateFilter()
-
-    def filterAcceptsRow(self, sourceRow, sourceParent):
-        """Overriding the parent function to check
-        check the date is not too old"""
-        if self.filterKeyColumn() == 0:
-            # Fetch datetime value.
-            index = self.sourceModel().index(sourceRow, 0, sourceParent)
-            return self.sourceModel().data(index) > self._minDate
-        # Not our business.
-        return super(DateFilterProxyModel, self).filterAcceptsRow(sourceRow,
-                                                                  sourceParent)
-
-
-class CascadingFilterModel(DateFilterProxyModel):
     def __init__(self):
         super().__init__()
         self.original_model = None
-        self.sort_elem_model = DateFilterProxyModel()
-        self.sort_interf_model = DateFilterProxyModel()
-        self.sort_interf_model.setSourceModel(self.sort_elem_model)
-        self.setSourceModel(self.sort_interf_model)
-        self.setFilterKeyColumn(0)
-        self.setFilterMinimumDate(QtCore.QDate(2014, 1, 1))
-        self.sort_elem_model.setFilterKeyColumn(2)
-        self.sort_interf_model.setFilterKeyColumn(3)
+        # sets of accepted atom numbers, None if any is accepted:
+        self._measured = None
+        self._overlaping = None
+        self._minDate = QtCore.QDate(2014, 1, 1)
+        self._mask = None
+        self.setSortRole(sort_role)
 
     def set_original_model(self, model):
         self.original_model = model
-        self.sort_elem_model.setSourceModel(self.original_model)
+        model.modelAboutToBeReset.connect(self._drop_mask)
+        model.rowsInserted.connect(self._rows_inserted)
+        model.rowsRemoved.connect(self._drop_mask)
+        self._mask = None
+        if self.sortColumn() >= 0:
+            model.fetch_all()
+        self.setSourceModel(self.original_model)
+
+    def _drop_mask(self, *args):
+        self._mask = None
+
+    def _rows_inserted(self, *args):
+        # the mask covers all rows of the source, not only fetched ones,
+        # thus it is outdated only if the rows were added to the data:
+        if (self._mask is not None) and\
+                (len(self._mask) < self.original_model._total_rows()):
+            self._mask = None
+
+    def sort(self, column, order=QtCore.Qt.AscendingOrder):
+        if (column >= 0) and (self.original_model is not None):
+            self.original_model.fetch_all()
+        super().sort(column, order)
+
+    def _update_mask(self):
+        atoms, i_atoms, oldest = self.original_model.filter_fields()
+        measured, overlaping = self._measured, self._overlaping
+        # oldest use date have to be later than minimum date:
+        threshold = datetime.combine(
+            self._minDate.toPyDate() + timedelta(days=1),
+            datetime.min.time()).timestamp()
+        index = self.original_model.overlap_index
+        if index is not None:
+            self._mask = bytearray(len(oldest))
+            for r in index.rows(atom=measured, i_atom=overlaping):
+                if oldest[r] >= threshold:
+                    self._mask[r] = 1
+            return
+        self._mask = bytearray(
+            ((measured is None) or (a in measured)) and
+            ((overlaping is None) or (i in overlaping)) and (t >= threshold)
+            for a, i, t in zip(atoms, i_atoms, oldest))
+
+    def _refilter(self):
+        self._mask = None
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, sourceRow, sourceParent):
+        if self._mask is None:
+            self._update_mask()
+        return bool(self._mask[sourceRow])
+
+    @staticmethod
+    def _atom_set(element_list):
+        if len(element_list) == 0:
+            return None
+        return {CamecaBase.to_atom_number(i) for i in element_list}
+
+    def setFilterMinimumDate(self, date):
+        self._minDate = date
+        self._refilter()
 
     def setElementFilter(self, element_list):
-        regex = '\\s|'.join(element_list) + '\\s'
-        self.sort_elem_model.setFilterRegExp(regex)
-        self.sort_interf_model.setFilterRegExp(regex)
+        self._measured = self._atom_set(element_list)
+        self._overlaping = self._atom_set(element_list)
+        self._refilter()
 
     def setMeasuredElementFilter(self, element_list):
-        regex = '\\s|'.join(element_list) + '\\s'
-        self.sort_elem_model.setFilterRegExp(regex)
+        self._measured = self._atom_set(element_list)
+        self._refilter()
 
     def setOverlapingElementFilter(self, element_list):
-        regex = '\\s|'.join(element_list) + '\\s'
-        self.sort_interf_model.setFilterRegExp(regex)
+        self._overlaping = self._atom_set(element_list)
+        self._refilter()
 
     def get_original_node(self, index):
-        level0 = self.mapToSource(index)
-        level1 = self.sort_interf_model.mapToSource(level0)
-        level2 = self.sort_elem_model.mapToSource(level1)
-        return self.original_model.getNode(level2)
+        return self.original_model.getNode(self.mapToSource(index))
+
+
+class QtiSetupRefresher(QtCore.QObject):
+    """refreshes the qtiSet without blocking the GUI: if the file is
+    locked or half written (by PeakSight) the refresh is retried with
+    the timer and exponentially growing delay until it succeeds or
+    the deadline passes; completion is signalled with finished"""
+    # True if the qtiSet got reparsed:
+    finished = QtCore.pyqtSignal(bool)
+
+    def __init__(self, first_delay=qti_retry_delay,
+                 deadline=qti_retry_deadline, parent=None):
+        """first_delay -- delay before the first retry in milliseconds
+        deadline -- time in milliseconds after which retrying is given up
+        """
+        super().__init__(parent)
+        self.first_delay = first_delay
+        self.deadline = deadline
+        self.qti_setup = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._attempt)
+        self.elapsed = QtCore.QElapsedTimer()
+
+    def start(self, qti_setup):
+        """start refreshing; the pending retries of previous one
+        are dropped"""
+        self.timer.stop()
+        self.qti_setup = qti_setup
+        self.delay = self.first_delay
+        self.elapsed.start()
+        self._attempt()
+
+    def _attempt(self):
+        try:
+            refreshed = self.qti_setup.refresh()
+        except parse_errors as e:  # PermissionError included
+            locked = isinstance(e, PermissionError)
+            if self.elapsed.elapsed() > self.deadline:
+                if locked:
+                    warnung = ms_stinks.format(self.deadline)
+                else:
+                    warnung = half_written.format(e, self.deadline)
+                logging.warning(html_colorify(warnung, 'red'))
+                self.finished.emit(False)
+                return
+            if locked:
+                logging.warning(html_colorify(the_root_of_all_evil,
+                                              'yellow'))
+            self.timer.start(self.delay)
+            self.delay *= 2
+            return
+        self.finished.emit(refreshed)
+
+
+class RefreshScheduler(QtCore.QObject):
+    """collects the changed paths reported by file watcher and emits
+    all of them at once with refresh signal after the quiet period
+    without new changes"""
+    refresh = QtCore.pyqtSignal(set)
+
+    def __init__(self, quiet_period=refresh_quiet_period, parent=None):
+        """quiet_period -- time in milliseconds (default
+        refresh_quiet_period)"""
+        super().__init__(parent)
+        self.paths = set()
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(quiet_period)
+        self.timer.timeout.connect(self._fire)
+
+    def add_path(self, path):
+        self.paths.add(os.path.abspath(path))
+        self.timer.start()  # (re)start the quiet period
+
+    def _fire(self):
+        paths, self.paths = self.paths, set()
+        self.refresh.emit(paths)
 
 
 class QPlainTextEditLogger(logging.Handler):
@@ -616,13 +621,24 @@ class QPlainTextEditLogger(logging.Handler):
         super().__init__()
         self.widget = widget  # QtWidgets.QPlainTextEdit()
         self.widget.setReadOnly(True)
+        # records can come from the library scanner thread, thus
+        # those are passed to widget through the (queued) signal:
+        self.relay = LogRelay()
+        self.relay.message.connect(self.widget.appendHtml)
 
     def emit(self, record):
         msg = self.format(record)
-        self.widget.appendHtml(msg)
+        self.relay.message.emit(msg)
+
+
+class LogRelay(QtCore.QObject):
+    message = QtCore.pyqtSignal(str)
 
 
 class MainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
+    # generation, OverlapLibrary, fingerprints, batches:
+    scanRequested = QtCore.pyqtSignal(int, object, object, bool)
+
     def __init__(self):
         super().__init__()
         self.setupUi(self)
@@ -636,6 +652,8 @@ class MainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         self.minDateEdit.dateChanged.connect(
             self.filterModel.setFilterMinimumDate)
         self.el_line_protect = False
+        self.overlap_library = None
+        self._setup_library_scanner()
         # create overlap model and set it to be source model of filter model:
         self.create_available_overlaps_model(qtiSet_path)
         # setup interface for element selection:
@@ -668,8 +686,31 @@ class MainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         self.overlap_file_view.hideColumn(0)
         self.overlap_file_view.hideColumn(1)
         self.file_watcher.addPath(qtiSet_path)
-        self.file_watcher.directoryChanged.connect(self.refresh_data)
-        self.file_watcher.fileChanged.connect(self.refresh_data)
+        if os.path.isdir(os.path.join(qtiSet_path, 'Overlap')):
+            self.file_watcher.addPath(os.path.join(qtiSet_path, 'Overlap'))
+        # PeakSight writes files in several steps, thus the changes are
+        # coalesced into the single refresh:
+        self.refresh_scheduler = RefreshScheduler(parent=self)
+        self.file_watcher.directoryChanged.connect(
+            self.refresh_scheduler.add_path)
+        self.file_watcher.fileChanged.connect(self.refresh_scheduler.add_path)
+        self.refresh_scheduler.refresh.connect(self.refresh_data)
+        self.qti_refresher = QtiSetupRefresher(parent=self)
+        self.qti_refresher.finished.connect(self.qti_setup_refreshed)
+
+    def _setup_library_scanner(self):
+        self.scan_generation = 0
+        self.library_presented = False
+        self.library_thread = QtCore.QThread(self)
+        self.library_scanner = LibraryScanner()
+        self.library_scanner.moveToThread(self.library_thread)
+        self.scanRequested.connect(self.library_scanner.scan)
+        self.library_scanner.batchReady.connect(self.append_library_batch)
+        self.library_scanner.progress.connect(self.show_scan_progress)
+        self.library_scanner.fileError.connect(self.log_scan_error)
+        self.library_scanner.cacheLoaded.connect(self.present_library)
+        self.library_scanner.finished.connect(self.present_library)
+        self.library_thread.start()
 
     def _setup_logging(self):
         self.logTextBox = QPlainTextEditLogger(self.text_interface)
@@ -679,11 +720,28 @@ class MainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         logging.getLogger().addHandler(self.logTextBox)
         logging.getLogger().setLevel(logging.WARNING)
 
-    def refresh_data(self):
+    def refresh_data(self, changed=None):
+        """refresh the qtiSet (if it is concerned) and the library.
+        changed -- set of changed paths collected by refresh scheduler
+                   (default None - everything is refreshed)"""
         # reset qtiSet if available:
         if self.el_line_protect:
-            self.qti_setup.refresh()
-            self.check_coverage()
+            qti_file = os.path.abspath(self.qti_setup.filename)
+            # file replaced by rename drops out of the watcher:
+            if os.path.isfile(qti_file) and\
+                    (qti_file not in map(os.path.abspath,
+                                         self.file_watcher.files())):
+                self.file_watcher.addPath(qti_file)
+            if (changed is None) or\
+                    (qti_file in changed) or\
+                    (os.path.dirname(qti_file) in changed):
+                # library is refreshed after it, see qti_setup_refreshed
+                self.qti_refresher.start(self.qti_setup)
+                return
+        self.create_available_overlaps_model(qtiSet_path)
+
+    def qti_setup_refreshed(self, refreshed):
+        self.check_coverage()
         self.create_available_overlaps_model(qtiSet_path)
 
     def changeElementFilter(self):
@@ -705,18 +763,55 @@ class MainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
         self.changeElementFilter()
 
     def create_available_overlaps_model(self, qtiDat_path):
-        self.available_ovl_model = OverlapFileModel()
-        overlap_agregate = CamecaOverlap()
-        ovl_list = glob(os.path.join(qtiDat_path, 'Overlap', '*.ovl'))
-        overleafs = [CamecaOverlap(k) for k in ovl_list]
-        for i in overleafs:
-            for j in i.overlaps:
-                if not self.el_line_protect:
-                    overlap_agregate.append_unique_overlap(j)
-                elif j.fingerprint in self.qti_setup.fingerprints:
-                    overlap_agregate.append_unique_overlap(j)
-        self.available_ovl_model.set_cameca_overlap(overlap_agregate)
-        self.filterModel.set_original_model(self.available_ovl_model)
+        """request the (background) update of the available overlaps;
+        the newer request supersedes the running one"""
+        overlap_dir = os.path.join(qtiDat_path, 'Overlap')
+        if (self.overlap_library is None) or\
+                (self.overlap_library.overlap_dir != overlap_dir):
+            self.overlap_library = OverlapLibrary(overlap_dir)
+            self.available_ovl_model = OverlapFileModel(
+                fetch_batch=library_fetch_batch)
+            self.filterModel.set_original_model(self.available_ovl_model)
+            self.library_presented = False
+            self.library_scanner.presented_changes = -1
+        if self.el_line_protect:
+            fingerprints = self.qti_setup.fingerprint_set
+        else:
+            fingerprints = None
+        self.scan_generation += 1
+        self.library_scanner.generation = self.scan_generation
+        self.scanRequested.emit(self.scan_generation, self.overlap_library,
+                                fingerprints, not self.library_presented)
+
+    def append_library_batch(self, generation, overlaps):
+        if generation != self.scan_generation:
+            return
+        if self.available_ovl_model.cam_overlaps is None:
+            self.available_ovl_model.set_cameca_overlap(
+                CamecaOverlap(), columnar=columnar_library,
+                index=OverlapIndex())
+        self.available_ovl_model.rows_appended(overlaps)
+
+    def show_scan_progress(self, generation, done, total):
+        if generation == self.scan_generation:
+            self.statusBar.showMessage(
+                'parsing overlap files: {0}/{1}'.format(done, total), 2000)
+
+    def log_scan_error(self, path, message):
+        warnung = ' '.join([path, 'could not be parsed:', message])
+        logging.warning(html_colorify(warnung, 'yellow'))
+
+    def present_library(self, generation, presentation):
+        if (generation != self.scan_generation) or (presentation is None):
+            return  # superseded by the newer scan or nothing new
+        cam_overlaps, columns, index, changes = presentation
+        self.available_ovl_model.set_cameca_overlap(cam_overlaps,
+                                                    index=index,
+                                                    columns=columns)
+        # the scanner reads it only at the end of the scan; if it
+        # misses this value, it just builds the presentation once more:
+        self.library_scanner.presented_changes = changes
+        self.library_presented = True
 
     def toggle_pet(self):
         """show or hide periodic element table"""
@@ -743,7 +838,7 @@ class MainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
 
     def check_coverage(self):
         not_covered = self.overlap_file_model.checkOverlapCover(
-            self.qti_setup.fingerprints)
+            self.qti_setup.fingerprint_set)
         if len(not_covered) > 0:
             if self.remove_excesive_overlap_dlg():
                 self.remove_excesive_overlaps(not_covered)
@@ -796,8 +891,13 @@ class MainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
                 v = self.qti_setup.file_version
             else:
                 v = 3
-            self.overlap_file_model.cam_overlaps.save_to_file(version=v)
-            self.overlap_file_model.modified = False
+            try:
+                self.overlap_file_model.cam_overlaps.save_to_file(
+                    version=v, backups=overlap_backups)
+                self.overlap_file_model.modified = False
+            except OSError as e:
+                # the atomic save leaves the original file untouched:
+                logging.error('saving failed: ' + str(e))
             self.file_watcher.blockSignals(False)
 
     def delete_selected_entries(self):
@@ -898,6 +998,10 @@ class MainWindow(Ui_MainWindow, QtWidgets.QMainWindow):
 
         if state:
             self.elem_table.close()  # be sure to close the element table too
+            # cancel the running scan and stop its thread:
+            self.library_scanner.generation = -1
+            self.library_thread.quit()
+            self.library_thread.wait()
             event.accept()
         else:
             event.ignore()
@@ -0,0 +1,355 @@
+# Copyright Petras Jokubauskas 2016
+"""Command line batch tool for Cameca PeakSight overlap (.ovl) files.
+
+examples:
+  merge all overlap files of the Quanti tree into one file, keeping only
+  Fe and Mg overlaps measured on LIF crystals (duplicates are dropped):
+    python CamOverlapTool.py merge all.ovl Quanti --element Fe Mg --xtal LIF
+  report and then remove the overlap entries not covered by sibling qtiSet
+  files and the duplicate entries:
+    python CamOverlapTool.py sweep Quanti
+    python CamOverlapTool.py prune Quanti
+  list overlaps of the library measuring Fe Kα on spectrometer 3 with LIF
+  together with the setups using them:
+    python CamOverlapTool.py list Quanti --element Fe --line Ka \\
+        --spectrometer 3 --xtal LIF --setups
+  list the library overlaps not used by any of the setups:
+    python CamOverlapTool.py orphans Quanti
+"""
+
+import argparse
+import logging
+import os
+import sys
+from datetime import datetime
+from glob import glob
+
+from cameca import (CamecaBase, CamecaOverlap, OverlapLibrary, OverlapWriter,
+                    QtiSetupCatalogue, get_xtal, iter_overlaps, parse_errors,
+                    sweep_overlap_dir)
+
+logger = logging.getLogger('CamOverlapTool')
+
+
+def element_number(element):
+    try:
+        return CamecaBase.to_atom_number(element)
+    except KeyError:
+        raise argparse.ArgumentTypeError('unknown element ' + element)
+
+
+def line_number(line):
+    try:
+        return CamecaBase.to_line_number(line)
+    except KeyError:
+        raise argparse.ArgumentTypeError('unknown x-ray line ' + line)
+
+
+def date(string):
+    try:
+        return datetime.strptime(string, '%Y-%m-%d')
+    except ValueError:
+        raise argparse.ArgumentTypeError('date should be given as YYYY-MM-DD')
+
+
+def collect_ovl_files(paths):
+    """return sorted list of overlap files from given files and
+    directories (the directory and its Overlap subdirectory are
+    searched for .ovl files)"""
+    files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            files.update(glob(os.path.join(path, '*.ovl')))
+            files.update(glob(os.path.join(path, 'Overlap', '*.ovl')))
+        else:
+            files.add(path)
+    return sorted(files)
+
+
+def make_filter(args):
+    """return the predicate of OverlapItem built from the filtering
+    arguments, or None if no filtering is requested"""
+    tests = []
+    if args.element:
+        elements = set(args.element)
+        tests.append(lambda item: item.atom in elements)
+    if args.line:
+        lines = set(args.line)
+        tests.append(lambda item: item.line in lines)
+    if args.overlapping:
+        overlapping = set(args.overlapping)
+        tests.append(lambda item: item.i_atom in overlapping)
+    if args.spectrometer:
+        spectrometers = set(args.spectrometer)
+        tests.append(lambda item: item.spect_nr in spectrometers)
+    if args.xtal:
+        xtals = set(i.upper() for i in args.xtal)
+        tests.append(lambda item:
+                     get_xtal(item.spect_name.decode()[::-1]) in xtals)
+    if args.since:
+        tests.append(lambda item: item.oldest >= args.since)
+    if len(tests) == 0:
+        return None
+    return lambda item: all(test(item) for test in tests)
+
+
+def merge(args):
+    output = None
+    if not args.keep_duplicates:
+        output = CamecaOverlap()
+        output.filename = args.output
+        output.file_comment = args.comment
+    elif not args.dry_run:
+        output = OverlapWriter(args.output, comment=args.comment,
+                               version=args.file_version,
+                               backups=args.backups)
+    try:
+        failed = merge_into(output, args)
+    except BaseException:
+        # the streamed output is not left as temporary file:
+        if args.keep_duplicates and (output is not None):
+            output.discard()
+        raise
+    if args.dry_run:
+        pass
+    elif args.keep_duplicates:
+        output.close()
+    else:
+        output.save_to_file(version=args.file_version, backups=args.backups)
+    return 1 if failed else 0
+
+
+def merge_into(output, args):
+    """read the input overlap files of merge into the output (CamecaOverlap,
+    OverlapWriter or None at dry run with duplicates kept), return the
+    number of failed files"""
+    predicate = make_filter(args)
+    n_read = 0
+    n_kept = 0
+    failed = 0
+    for filename in collect_ovl_files(args.inputs):
+        if os.path.abspath(filename) == os.path.abspath(args.output):
+            continue
+        if not os.path.isfile(filename):
+            logger.error('{0}: no such file'.format(filename))
+            failed += 1
+            continue
+        # records are streamed, input files are never held in memory:
+        try:
+            for item in iter_overlaps(filename):
+                n_read += 1
+                if (predicate is not None) and not predicate(item):
+                    continue
+                n_kept += 1
+                if not args.keep_duplicates:
+                    output.append_unique_overlap(item)
+                elif output is not None:
+                    output.write(item)
+        except parse_errors as e:
+            logger.error('{0}: {1}'.format(filename, e))
+            failed += 1
+    if not args.keep_duplicates:
+        n_kept = output.n_overlaps
+    logger.info('{0} overlaps read, {1} written to {2}'.format(
+        n_read, n_kept, args.output))
+    return failed
+
+
+def index_criteria(args):
+    """return OverlapIndex.rows criteria built from the filtering
+    arguments and the predicate for those which are not indexed
+    (or None)"""
+    criteria = {'i_atom': args.overlapping,
+                'spect_nr': args.spectrometer,
+                'xtal': args.xtal and [i.upper() for i in args.xtal]}
+    if args.element and args.line:
+        criteria['atom_line'] = [(a, b) for a in args.element
+                                 for b in args.line]
+    else:
+        criteria['atom'] = args.element
+    tests = []
+    if args.line and not args.element:
+        lines = set(args.line)
+        tests.append(lambda item: item.line in lines)
+    if args.since:
+        tests.append(lambda item: item.oldest >= args.since)
+    if len(tests) == 0:
+        return criteria, None
+    return criteria, lambda item: all(test(item) for test in tests)
+
+
+def load_library(quanti, failed):
+    library = OverlapLibrary(os.path.join(quanti, 'Overlap'))
+    library.update(error_callback=lambda path, e: failed.append((path, e)))
+    return library
+
+
+def load_catalogue(quanti, failed):
+    catalogue = QtiSetupCatalogue(quanti)
+    catalogue.update(error_callback=lambda path, e: failed.append((path, e)))
+    return catalogue
+
+
+def report_failed(failed):
+    for path, e in failed:
+        logger.error('{0}: {1}'.format(path, e))
+    return 1 if failed else 0
+
+
+def print_overlaps(overlaps, extra=None):
+    """print tab separated overlap attributes, optionally followed by
+    the column returned by extra function of the overlap"""
+    for item in overlaps:
+        fields = [item.__repr__(), item.order, item.offset, item.HV,
+                  item.beam_cur, item.peak_bkd, item.std_name, item.spect_nr,
+                  item.spect_name.decode()[::-1], item.n_metadata,
+                  item.oldest.date()]
+        if extra is not None:
+            fields.append(extra(item))
+        print('\t'.join(str(i) for i in fields))
+
+
+def list_overlaps(args):
+    failed = []
+    library = load_library(args.quanti, failed)
+    criteria, predicate = index_criteria(args)
+    overlaps = library.query(**criteria)
+    if predicate is not None:
+        overlaps = [i for i in overlaps if predicate(i)]
+    if args.setups:
+        catalogue = load_catalogue(args.quanti, failed)
+
+        def setups(item):
+            return ' '.join(catalogue.setups_using(item.fingerprint))
+        print_overlaps(overlaps, setups)
+    else:
+        print_overlaps(overlaps)
+    logger.info('{0} of {1} overlaps listed'.format(
+        len(overlaps), len(library.aggregate.overlaps)))
+    return report_failed(failed)
+
+
+def orphans(args):
+    failed = []
+    library = load_library(args.quanti, failed)
+    catalogue = load_catalogue(args.quanti, failed)
+    overlaps = catalogue.orphaned_in_library(library)
+
+    def sources(item):
+        """the overlap files containing the orphan"""
+        return ' '.join(sorted(set(i[1] for i in item.metadata)))
+    print_overlaps(overlaps, sources)
+    logger.info('{0} of {1} overlaps are not used by any of {2} setups'.format(
+        len(overlaps), len(library.aggregate.overlaps),
+        len(catalogue.setups)))
+    return report_failed(failed)
+
+
+def sweep(args):
+    """report (sweep command) or remove (prune command) the overlaps
+    not covered by the sibling qtiSet setups and the duplicates"""
+    reports = sweep_overlap_dir(
+        args.quanti, prune=(args.command == 'prune') and not args.dry_run,
+        backups=args.backups)
+    failed = 0
+    for report in reports:
+        name = os.path.basename(report['path'])
+        if report['error'] is not None:
+            logger.error('{0}: {1}'.format(name, report['error']))
+            failed += 1
+        elif report['setup'] is None:
+            print('\t'.join([name, 'orphaned (no qtiSet setup)']))
+        elif report['uncovered'] or report['duplicates'] or\
+                report['conflicts']:
+            print('\t'.join(str(i) for i in [
+                name, report['n_overlaps'],
+                'uncovered: {0}'.format(len(report['uncovered'])),
+                'duplicates: {0}'.format(len(report['duplicates'])),
+                'conflicts: {0}'.format(len(report['conflicts'])),
+                'pruned: {0}'.format(report['pruned'])]))
+    logger.info('{0} overlap files swept, {1} entries pruned'.format(
+        len(reports), sum(i['pruned'] for i in reports)))
+    return 1 if failed else 0
+
+
+def add_filter_arguments(parser):
+    group = parser.add_argument_group('filtering')
+    group.add_argument('--element', nargs='+', type=element_number,
+                       metavar='EL', help='measured elements to keep')
+    group.add_argument('--line', nargs='+', type=line_number,
+                       metavar='LINE',
+                       help="measured x-ray lines to keep (i.e. Ka or Kα)")
+    group.add_argument('--overlapping', nargs='+', type=element_number,
+                       metavar='EL', help='overlapping elements to keep')
+    group.add_argument('--spectrometer', nargs='+', type=int, metavar='NR',
+                       help='spectrometer numbers to keep')
+    group.add_argument('--xtal', nargs='+', metavar='XTAL',
+                       help='crystal types to keep (i.e. LIF PET)')
+    group.add_argument('--since', type=date, metavar='YYYY-MM-DD',
+                       help='keep overlaps from files modified since')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='report what is done')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='do not write any files')
+    parser.add_argument('-b', '--backups', type=int, default=0, metavar='N',
+                        help=('number of rotated backups (.bak1, .bak2 ...) '
+                              'of overwritten files to keep (default: 0)'))
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    merge_parser = commands.add_parser(
+        'merge', help='merge, deduplicate and filter overlap files')
+    merge_parser.add_argument('output', help='overlap file to write')
+    merge_parser.add_argument('inputs', nargs='+',
+                              help='overlap files or directories')
+    merge_parser.add_argument('--file-version', type=int, default=3,
+                              choices=[3, 4], help='default: 3')
+    merge_parser.add_argument('--comment', default='',
+                              help='comment of written file')
+    merge_parser.add_argument('--keep-duplicates', action='store_true',
+                              help=('do not deduplicate, but stream the '
+                                    'records in constant memory'))
+    add_filter_arguments(merge_parser)
+    merge_parser.set_defaults(func=merge)
+
+    sweep_parser = commands.add_parser(
+        'sweep', help=('report overlaps not covered by the sibling qtiSet '
+                       'setups, duplicates, conflicts and orphaned files'))
+    sweep_parser.add_argument('quanti', help='Quanti directory')
+    sweep_parser.set_defaults(func=sweep)
+
+    prune_parser = commands.add_parser(
+        'prune', help=('as sweep, but remove the not covered and duplicate '
+                       'overlaps (single atomic write per file)'))
+    prune_parser.add_argument('quanti', help='Quanti directory')
+    prune_parser.set_defaults(func=sweep)
+
+    list_parser = commands.add_parser(
+        'list', help='list the unique overlaps of the Quanti library')
+    list_parser.add_argument('quanti', help='Quanti directory')
+    list_parser.add_argument('--setups', action='store_true',
+                             help='show the setups using the overlaps')
+    add_filter_arguments(list_parser)
+    list_parser.set_defaults(func=list_overlaps)
+
+    orphans_parser = commands.add_parser(
+        'orphans', help=('list the library overlaps not used by any '
+                         'of the qtiSet setups'))
+    orphans_parser.add_argument('quanti', help='Quanti directory')
+    orphans_parser.set_defaults(func=orphans)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    if args.verbose:
+        logger.setLevel(logging.INFO)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
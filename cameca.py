@@ -0,0 +1,1558 @@
+# Copyright Petras Jokubauskas 2016
+"""Qt independent core of Cam-overlap-manager: the readers and writers
+of Cameca PeakSight overlap (.ovl) and Quanti setup (.qtiSet) files
+and the overlap library index. It can be used by the batch tools
+without loading PyQt5."""
+
+import struct
+from io import BytesIO
+import logging
+from glob import glob
+from operator import itemgetter
+from copy import copy
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import pickle
+import hashlib
+from array import array
+from bisect import bisect_left
+import tempfile
+import shutil
+
+from datetime import datetime, timedelta
+import os
+
+if os.name == 'nt':
+    import winreg
+    try:
+        with winreg.OpenKey(winreg.HKEY_CURRENT_USER,
+                            r"SOFTWARE\Cameca\SX\Configuration") as thingy:
+            data_path = winreg.QueryValueEx(thingy, "DataPath")[0]
+        qtiSet_path = os.path.join(data_path, 'Analysis Setups', 'Quanti')
+    except EnvironmentError:
+        logging.warning(
+            'Cameca PeakSight sotware were not dected on the system')
+
+# for development and debugging on linux/bsd:
+elif os.name == 'posix':
+    # the path with sample qtiSet files
+    qtiSet_path = 'Quanti'
+
+# the per-user cache directory (parsed overlap library is kept there):
+if os.name == 'nt':
+    cache_path = os.path.join(os.environ.get('LOCALAPPDATA',
+                                             os.path.expanduser('~')),
+                              'Cam-overlap-manager')
+else:
+    cache_path = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                             os.path.join(
+                                                 os.path.expanduser('~'),
+                                                 '.cache')),
+                              'Cam-overlap-manager')
+library_cache_file = os.path.join(cache_path, 'overlap_library.cache')
+
+# umask of the process, read once at import, as reading it means
+# setting it for the whole process (other threads would create files
+# with the temporary value):
+if os.name == 'posix':
+    process_umask = os.umask(0)
+    os.umask(process_umask)
+
+# number of threads parsing the overlap files of the library:
+parse_workers = 4
+
+# exceptions raised by the parsers on broken or truncated files:
+parse_errors = (IOError, ValueError, KeyError, RuntimeError, OverflowError,
+                struct.error)
+
+
+# handy functions:
+def filetime_to_datetime(filetime):
+    """Return recalculated lame windows filetime
+    to usable python (unix) datetime."""
+    return datetime(1601, 1, 1) + timedelta(microseconds=filetime / 10)
+
+
+def datetime_to_filetime(date):
+    """Return windows filetime of the datetime,
+    inverse of filetime_to_datetime."""
+    return (date - datetime(1601, 1, 1)) // timedelta(microseconds=1) * 10
+
+
+def mod_date(filename):
+    """Return datetime of file's last modification"""
+    t = os.path.getmtime(filename)
+    return datetime.fromtimestamp(t)
+
+
+def html_colorify(string, color):
+    return r'<font color="{1}">{0}<\font>'.format(string, color)
+
+
+def rotate_backups(filename, backups):
+    """copy the file to filename.bak1 shifting the older backups
+    (filename.bak1 -> filename.bak2 ...), keeping given number of them"""
+    if (backups < 1) or not os.path.isfile(filename):
+        return
+    for i in range(backups - 1, 0, -1):
+        older = '{0}.bak{1}'.format(filename, i)
+        if os.path.isfile(older):
+            os.replace(older, '{0}.bak{1}'.format(filename, i + 1))
+    shutil.copy2(filename, filename + '.bak1')
+
+
+class AtomicFile(object):
+    """binary file written under temporary name next to the target and
+    renamed over it only at commit, so that PeakSight never sees partly
+    written file and the original survives the crash during writing.
+    arguments:
+    filename -- path of the target file
+    backups -- number of rotated backups of the replaced file to keep
+               (default 0)
+
+    as context manager it commits at success and discards at exception
+    """
+
+    def __init__(self, filename, backups=0):
+        self.filename = filename
+        self.backups = backups
+        directory = os.path.dirname(os.path.abspath(filename))
+        fd, self.temp_name = tempfile.mkstemp(
+            prefix='.' + os.path.basename(filename) + '.',
+            suffix='.tmp', dir=directory)
+        self.file = os.fdopen(fd, 'bw')
+        # mkstemp creates file readable only by the owner:
+        if os.path.exists(filename):
+            shutil.copymode(filename, self.temp_name)
+        elif os.name == 'posix':
+            os.chmod(self.temp_name, 0o666 & ~process_umask)
+
+    def commit(self):
+        try:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.file.close()
+            rotate_backups(self.filename, self.backups)
+            os.replace(self.temp_name, self.filename)
+        except OSError:
+            self.discard()
+            raise
+        if os.name == 'posix':  # make the rename itself durable
+            dir_fd = os.open(os.path.dirname(os.path.abspath(self.filename)),
+                             os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.temp_name):
+            os.remove(self.temp_name)
+
+    def __enter__(self):
+        return self.file
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+
+greek_to_latin = str.maketrans('αβγνζ', 'abgnz')
+
+
+def get_xtal(full_xtal_name):
+    """get basic crystal name.
+       example: get_xtal('LLIF') -> 'LIF'
+    """
+    for i in ['PC0', 'PC1', 'PC2', 'PC3', 'PET', 'TAP', 'LIF']:
+        if i in full_xtal_name:
+            return i
+
+
+class CamecaBase(object):
+    """base class with cameca data type translating methods
+    and cameca file header reader method useful
+    for any other derived Reader/Writer class"""
+
+    value_map = {
+                 1: 'WDS setup',
+                 2: 'Image/maping setup',
+                 3: 'Calibration setup',
+                 4: 'Quanti setup',
+                 5: 'unknown',  # What is this???
+                 6: 'WDS results',
+                 7: 'Image/maping results',
+                 8: 'Calibration results',
+                 9: 'Quanti results',
+                 10: 'Peak overlap table'
+                }
+    cameca_lines = {
+                    1: 'Kβ', 2: 'Kα',
+                    3: 'Lγ4', 4: 'Lγ3', 5: 'Lγ2', 6: 'Lγ',
+                    7: 'Lβ9', 8: 'Lβ10', 9: 'Lβ7', 10: 'Lβ2',
+                    11: 'Lβ6', 12: 'Lβ3', 13: 'Lβ4', 14: 'Lβ',
+                    15: 'Lα', 16: 'Lν', 17: 'Ll',
+                    18: 'Mγ', 19: 'Mβ', 20: 'Mα', 21: 'Mζ', 22: 'Mζ2',
+                    23: 'M1N2', 24: 'M1N3', 25: 'M2N1', 26: 'M2N4',
+                    27: 'M2O4', 28: 'M3N1', 29: 'M3N4', 30: 'M3O1',
+                    31: 'M3O4', 32: 'M4O2'
+                   }
+
+    element_table = {
+                     0: 'n', 1: 'H', 2: 'He', 3: 'Li', 4: 'Be', 5: 'B',
+                     6: 'C', 7: 'N', 8: 'O', 9: 'F', 10: 'Ne', 11: 'Na',
+                     12: 'Mg', 13: 'Al', 14: 'Si', 15: 'P', 16: 'S',
+                     17: 'Cl', 18: 'Ar', 19: 'K', 20: 'Ca', 21: 'Sc',
+                     22: 'Ti', 23: 'V', 24: 'Cr', 25: 'Mn', 26: 'Fe',
+                     27: 'Co', 28: 'Ni', 29: 'Cu', 30: 'Zn', 31: 'Ga',
+                     32: 'Ge', 33: 'As', 34: 'Se', 35: 'Br', 36: 'Kr',
+                     37: 'Rb', 38: 'Sr', 39: 'Y', 40: 'Zr', 41: 'Nb',
+                     42: 'Mo', 43: 'Tc', 44: 'Ru', 45: 'Rh', 46: 'Pd',
+                     47: 'Ag', 48: 'Cd', 49: 'In', 50: 'Sn', 51: 'Sb',
+                     52: 'Te', 53: 'I', 54: 'Xe', 55: 'Cs', 56: 'Ba',
+                     57: 'La', 58: 'Ce', 59: 'Pr', 60: 'Nd', 61: 'Pm',
+                     62: 'Sm', 63: 'Eu', 64: 'Gd', 65: 'Tb', 66: 'Dy',
+                     67: 'Ho', 68: 'Er', 69: 'Tm', 70: 'Yb', 71: 'Lu',
+                     72: 'Hf', 73: 'Ta', 74: 'W', 75: 'Re', 76: 'Os',
+                     77: 'Ir', 78: 'Pt', 79: 'Au', 80: 'Hg', 81: 'Tl',
+                     82: 'Pb', 83: 'Bi', 84: 'Po', 85: 'At', 86: 'Rn',
+                     87: 'Fr', 88: 'Ra', 89: 'Ac', 90: 'Th', 91: 'Pa',
+                     92: 'U', 93: 'Np', 94: 'Pu', 95: 'Am', 96: 'Cm',
+                     97: 'Bk', 98: 'Cf', 99: 'Es', 100: 'Fm', 101: 'Md',
+                     102: 'No', 103: 'Lr'
+                    }
+    atom_numbers = {v: k for k, v in element_table.items()}
+    # lines with greek letters transcribed to latin (i.e. 'Ka': 2):
+    line_numbers = {v.translate(greek_to_latin): k
+                    for k, v in cameca_lines.items()}
+
+    @classmethod
+    def to_type(cls, sx_type):
+        """return the string representation of cameca file type
+        from given integer code"""
+        return cls.value_map[sx_type]
+
+    @classmethod
+    def to_element(cls, number):
+        """return atom name for given atom number"""
+        return cls.element_table[number]
+
+    @classmethod
+    def to_atom_number(cls, element):
+        """return atom number for given atom name"""
+        return cls.atom_numbers[element]
+
+    @classmethod
+    def to_line(cls, number):
+        """ return stringof x-ray line from given cameca int code"""
+        return cls.cameca_lines[number]
+
+    @classmethod
+    def to_line_number(cls, line):
+        """return cameca int code of x-ray line given as 'Kα' or 'Ka'"""
+        return cls.line_numbers[line.translate(greek_to_latin)]
+
+    @staticmethod
+    def _header_bytes(file_type, version=3, comment='', changes=[]):
+        """return bytes of the header as parsed by _read_the_header.
+        file_type -- coded int value of cameca file/data type
+        version -- version of the file (default 3)
+        comment -- string with comment of file (default empty string)
+        changes -- list of [datetime, comment] change log entries
+                   (default empty list)
+        """
+        comment = comment.encode()
+        parts = [struct.pack('<B3sii', file_type, b'fxs',
+                             version, len(comment)),
+                 comment,
+                 0x1C * b'\x00',
+                 struct.pack('<i', len(changes))]
+        for date, change in changes:
+            change = change.encode()
+            parts.append(struct.pack('<Qi', datetime_to_filetime(date),
+                                     len(change)))
+            parts.append(change)
+        if version == 4:
+            parts.append(0x08 * b'\x00')
+        return b''.join(parts)
+
+    def _read_the_header(self, fbio):
+        """parse the header data into base cameca object atributes
+        arguments:
+        fbio -- file BytesIO object or the opened file
+        """
+        fbio.seek(0)
+        a, b, c, d = struct.unpack('<B3sii', fbio.read(12))
+        if b != b'fxs':
+            raise IOError('The file is not a cameca peaksight software file')
+        self.cameca_bin_file_type = a
+        self.file_type = self.to_type(a)
+        self.file_version = c
+        self.file_comment = fbio.read(d).decode()
+        fbio.seek(0x1C, 1)  # some spacer with unknown values
+        n_changes = struct.unpack('<i', fbio.read(4))[0]
+        self.changes = []
+        for i in range(n_changes):
+            filetime, change_len = struct.unpack('<Qi', fbio.read(12))
+            comment = fbio.read(change_len).decode()
+            self.changes.append([filetime_to_datetime(filetime),
+                                 comment])
+        if self.file_version == 4:
+            fbio.seek(0x08, 1)
+
+
+class CamecaQtiSetup(CamecaBase):
+    def __init__(self, filename):
+        self.parse_thing(filename)
+
+    def refresh(self):
+        """reparse the file if it got modified.
+        returns True if it got reparsed; PermissionError is raised if
+        file is still locked and one of parse_errors if it is not
+        completely written (retry is up to the caller)"""
+        if os.path.isfile(self.filename):
+            if mod_date(self.filename) != self.file_modification_date:
+                warnung = ".".join([self.file_basename,
+                                    "qtiSet got changed",
+                                    " trying to refresh..."])
+                logging.warning(html_colorify(warnung, 'yellow'))
+                self.parse_thing(self.filename)
+                return True
+        else:
+            warnung = ".".join([self.file_basename,
+                                "qtiSet got removed",
+                                " The ovl file is orphaned."])
+            logging.warning(html_colorify(warnung, 'yellow'))
+        return False
+
+    beam_fields = ['heat', 'HV', 'unkn1',
+                   'Xhi', 'Yhi', 'Xlo',
+                   'Ylo', 'apert_X', 'apert_Y', 'C1',
+                   'C2', 'unkn2', 'current',
+                   'BFocus', 'unkn3', 'unkn4', 'BFocus2',
+                   'size', 'asti_amp', 'asti_deg']
+    _beam_struct = struct.Struct('<20i')
+    _int_struct = struct.Struct('<i')
+
+    def parse_thing(self, filename):
+        """parse the qtiSet file; the attributes are replaced only after
+        the whole file got parsed, so that the failed parsing (i.e. of
+        the file being written by PeakSight) leaves them intact and
+        the next refresh retries it"""
+        # taken before reading, so that later change is not missed:
+        modification_date = mod_date(filename)
+        with open(filename, 'br') as fn:
+            # file bytes (read once, records are located by offsets):
+            data = fn.read()
+        # BytesIO initiated with bytes shares its buffer (no copy):
+        fbio = BytesIO(data)
+        header = CamecaBase()
+        header._read_the_header(fbio)
+        if header.cameca_bin_file_type != 4:
+            raise IOError(' '.join(['The file header shows it is not qtiSet',
+                                    'file, but', header.file_type]))
+        # parse data:
+        offset = fbio.tell() + 12  # unknown shit
+        unpack_int = self._int_struct.unpack_from
+        n_options = unpack_int(data, offset)[0]
+        offset += 4
+        # element record after its str_len: irrelevant shit and string
+        skip = 424 if header.file_version == 4 else 420
+        fingerprints = []
+        # number of elements in every option:
+        option_sizes = []
+        # offsets of beam fields, decoded only at access to options:
+        option_offsets = []
+        for i in range(n_options):
+            offset += 32  # skip another junk
+            option_offsets.append(offset)
+            offset += 80 + 424  # skip not so relevant information and junk
+            elements = unpack_int(data, offset)[0]
+            option_sizes.append(elements)
+            offset += 4
+            for j in range(elements):
+                # field_names2 = ['atom', 'line', 'spect no', 'xtal','2d','K']
+                # binary fingerprint are the first 16 bytes ('<3i4s'):
+                fingerprints.append(data[offset:offset + 16])
+                str_len = unpack_int(data, offset + 24)[0]
+                offset += 28 + skip + str_len
+        if offset > len(data):
+            raise IOError('qtiSet file is truncated')
+        self.filename = filename
+        self.file_basename = os.path.basename(filename).rsplit('.', 1)[0]
+        self.cameca_bin_file_type = header.cameca_bin_file_type
+        self.file_type = header.file_type
+        self.file_version = header.file_version
+        self.file_comment = header.file_comment
+        self.changes = header.changes
+        self.n_options = n_options
+        self.fingerprints = fingerprints
+        # for constant time coverage checks:
+        self.fingerprint_set = frozenset(fingerprints)
+        self._option_sizes = option_sizes
+        self._fingerprint_index = None
+        self._data = data
+        self._option_offsets = option_offsets
+        self._options = None
+        self.file_modification_date = modification_date
+
+    @property
+    def options(self):
+        """beam settings of every option ({option: {field: value}}),
+        decoded at the first access"""
+        if self._options is None:
+            unpack = self._beam_struct.unpack_from
+            self._options = {
+                i: dict(zip(self.beam_fields, unpack(self._data, offset)))
+                for i, offset in enumerate(self._option_offsets)}
+        return self._options
+
+    @property
+    def fingerprint_index(self):
+        """{fingerprint: [(option, element position), ...]},
+        built at the first access"""
+        if self._fingerprint_index is None:
+            index = {}
+            fingerprints = iter(self.fingerprints)
+            for i, elements in enumerate(self._option_sizes):
+                for j in range(elements):
+                    index.setdefault(next(fingerprints), []).append((i, j))
+            self._fingerprint_index = index
+        return self._fingerprint_index
+
+    def coverage(self, overlaps):
+        """return the list of booleans telling which of the given
+        overlaps (OverlapItem or alike objects) are covered by the
+        setup, that is its fingerprint is in the setup"""
+        fingerprint_set = self.fingerprint_set
+        return [i.fingerprint in fingerprint_set for i in overlaps]
+
+
+class CamecaOverlap(CamecaBase):
+    def __init__(self, filename=None):
+        self.filename = filename
+        # raw_str: OverlapItem index, built at first unique appending:
+        self.unique = None
+        if filename is None:
+            self.file_comment = ''
+            self.n_overlaps = 0
+            self.overlaps = []
+        elif os.path.exists(filename):
+            logging.info(filename + 'exists. Opening...')
+            with open(filename, 'br') as fn:
+                # file bytes (read once, records are decoded in place):
+                data = fn.read()
+            self.file_basename = os.path.basename(filename).rsplit('.', 1)[0]
+            self.file_modification_date = mod_date(filename)
+            # BytesIO initiated with bytes shares its buffer (no copy):
+            fbio = BytesIO(data)
+            self._read_the_header(fbio)
+            if self.cameca_bin_file_type != 10:
+                raise IOError(' '.join(['The file header shows it is not',
+                                        'overlap file, but',
+                                        self.file_type]))
+            offset = fbio.tell()
+            data_type, self.n_overlaps = struct.unpack_from('<2i', data,
+                                                            offset)
+            if data_type != 0:
+                raise RuntimeError(' '.join(['unexpected value of overlap',
+                                             'struct: instead of expected',
+                                             '0, the value',
+                                             str(data_type),
+                                             'at the address',
+                                             str(offset)]))
+            offset += 8
+            view = memoryview(data)
+            self.overlaps = []
+            for i in range(self.n_overlaps):
+                item = OverlapItem(view, offset)
+                offset += len(item.raw_str)
+                item.append_metadata([self.file_modification_date,
+                                      self.file_basename])
+                self.overlaps.append(item)
+            view.release()
+        else:
+            logging.info(filename +
+                         'does not exists. Creating new Overlap set...')
+            self.file_comment = ''
+            self.n_overlaps = 0
+            self.overlaps = []
+
+    def insert_overlap(self, index, overlap):
+        self.overlaps.insert(index, overlap)
+        self.n_overlaps += 1
+        if self.unique is not None:
+            self.unique.setdefault(overlap.raw_str, overlap)
+
+    def insert_overlaps(self, index, overlaps):
+        """insert the list of overlaps at the index in one go"""
+        self.overlaps[index:index] = overlaps
+        self.n_overlaps += len(overlaps)
+        if self.unique is not None:
+            for overlap in overlaps:
+                self.unique.setdefault(overlap.raw_str, overlap)
+
+    def remove_overlap(self, index):
+        overlap = self.overlaps.pop(index)
+        self.n_overlaps -= 1
+        if (self.unique is not None) and\
+                (self.unique.get(overlap.raw_str) is overlap):
+            del self.unique[overlap.raw_str]
+
+    def remove_overlaps(self, indexes):
+        """remove the overlaps at given indexes in one list rebuild"""
+        drop = set(indexes)
+        if len(drop) == 0:
+            return
+        removed = [self.overlaps[i] for i in drop]
+        first, last = min(drop), max(drop)
+        if last - first + 1 == len(drop):  # contiguous
+            del self.overlaps[first:last + 1]
+        else:
+            self.overlaps = [item for i, item in enumerate(self.overlaps)
+                             if i not in drop]
+        self.n_overlaps -= len(drop)
+        if self.unique is not None:
+            for overlap in removed:
+                if self.unique.get(overlap.raw_str) is overlap:
+                    del self.unique[overlap.raw_str]
+
+    def append_unique_overlap(self, overlap):
+        """append overlap if its identical is not yet present, else
+        merge its metadata into the present one (constant time).
+        returns True if the overlap got appended"""
+        if self.unique is None:
+            self.unique = {}
+            for i in self.overlaps:
+                self.unique.setdefault(i.raw_str, i)
+        item = self.unique.get(overlap.raw_str)
+        if item is not None:
+            item.append_metadata(overlap.metadata[0])
+            return False
+        self.unique[overlap.raw_str] = overlap
+        self.overlaps.append(overlap)
+        self.n_overlaps += 1
+        return True
+
+    def retract_unique_overlap(self, overlap, source):
+        """remove the metadata of given source file from the aggregated
+        equivalent of the overlap and drop the entry if it is not used
+        by any other file; counterpart of append_unique_overlap.
+        overlap -- OverlapItem which was appended from the source file
+        source -- basename of the overlap file
+        """
+        self.retract_unique_overlaps([([overlap.raw_str], source)])
+
+    def retract_unique_overlaps(self, sources):
+        """retract_unique_overlap for all overlaps of the source files,
+        dropping the unused entries in one list rebuild.
+        sources -- list of (raw records, source file basename) pairs
+        returns sorted list of removed indexes"""
+        if self.unique is None:
+            return []
+        emptied = set()
+        for records, source in sources:
+            for raw_str in records:
+                item = self.unique.get(raw_str)
+                if item is None:
+                    continue
+                item.remove_metadata(source)
+                if item.n_metadata == 0:
+                    emptied.add(id(item))
+        if len(emptied) == 0:
+            return []
+        drop = [i for i, item in enumerate(self.overlaps)
+                if id(item) in emptied]
+        self.remove_overlaps(drop)
+        return drop
+
+    def _initiate_with_header(self, version=3, changes=[]):
+        """
+        create and return BytesIO stream initiated with given header
+        information.
+        version -- version of the file (default 3)
+        changes -- list of [datetime, comment] change log entries
+                   (default empty list)
+        """
+        fbio = BytesIO()
+        fbio.write(self._header_bytes(10, version=version,
+                                      comment=self.file_comment,
+                                      changes=changes))
+        return fbio
+
+    def save_to_file(self, version=3, backups=0):
+        """write the overlaps into the file atomically: the header and
+        the raw records are streamed into the temporary file, which is
+        synced and renamed over the original.
+        arguments:
+        version -- the file version (default 3)
+        backups -- number of rotated backups of the replaced file
+                   (filename.bak1, filename.bak2 ...) to keep (default 0)
+        """
+        header = self._initiate_with_header(version=version)
+        with AtomicFile(self.filename, backups=backups) as fn:
+            fn.write(header.getbuffer())
+            fn.write(struct.pack('<2i', 0, self.n_overlaps))
+            fn.writelines(i.raw_str for i in self.overlaps)
+
+
+class OverlapItem(object):
+    # no per instance dictionary, as the library keeps many of them:
+    __slots__ = ('struct_type', 'atom', 'line', 'i_atom', 'i_line', 'order',
+                 'offset', 'HV', 'beam_cur', 'peak_bkd', 'str_len',
+                 'std_name', 'unknown1', 'spect_nr', 'spect_name',
+                 'dwelltime', 'unknown2', 'raw_str', 'fingerprint',
+                 'metadata', 'n_metadata', 'oldest')
+    _head_struct = struct.Struct('<7i3fi')
+    _spect_struct = struct.Struct('<2i4s')
+    _tail_struct = struct.Struct('<fi')
+
+    def __init__(self, fbio, offset=0):
+        """parse overlap item record
+        arguments:
+        fbio -- bytes, memoryview of the file bytes, or the BytesIO
+                object positioned at the record
+        offset -- start of the record in bytes/memoryview (default 0)
+        """
+        if isinstance(fbio, BytesIO):
+            view = fbio.getbuffer()
+            try:
+                self._parse(view, fbio.tell())
+            finally:
+                view.release()
+            fbio.seek(len(self.raw_str), 1)
+        else:
+            self._parse(fbio, offset)
+        self.metadata = []
+        self.n_metadata = 0
+
+    def _parse(self, buffer, offset):
+        self.struct_type, self.atom, self.line, self.i_atom,\
+            self.i_line, self.order, self.offset, self.HV, self.beam_cur,\
+            self.peak_bkd, self.str_len = self._head_struct.unpack_from(
+                buffer, offset)
+        if self.str_len < 0:
+            raise ValueError(' '.join(['negative standard name length',
+                                       str(self.str_len), 'at the address',
+                                       str(offset + 40)]))
+        i = offset + 44
+        j = i + self.str_len + 12
+        if self.struct_type == 3:
+            j += 8
+        if j > len(buffer):
+            raise ValueError(' '.join(['overlap record at the address',
+                                       str(offset),
+                                       'runs past the end of the file']))
+        self.std_name = str(buffer[i:i + self.str_len], 'utf-8')
+        i += self.str_len
+        self.unknown1, self.spect_nr, self.spect_name =\
+            self._spect_struct.unpack_from(buffer, i)
+        # (bytes.isascii is not available before python 3.7):
+        if max(self.spect_name) > 0x7F:
+            raise ValueError(' '.join(['unexpected crystal name',
+                                       str(self.spect_name),
+                                       'at the address', str(i + 8)]))
+        for atom, line in ((self.atom, self.line),
+                           (self.i_atom, self.i_line)):
+            if (atom not in CamecaBase.element_table) or\
+                    (line not in CamecaBase.cameca_lines):
+                raise ValueError(' '.join(['unexpected element', str(atom),
+                                           'or line', str(line),
+                                           'in the overlap record at the',
+                                           'address', str(offset)]))
+        if self.struct_type == 3:  # only version 3
+            self.dwelltime, self.unknown2 = self._tail_struct.unpack_from(
+                buffer, i + 12)
+        # we save raw string because we have few unknown values
+        # this makes the saving of overlap information less demanding;
+        # it is the only copy of the record data:
+        raw_str = buffer[offset:j]
+        if not isinstance(raw_str, bytes):
+            raw_str = bytes(raw_str)
+        self.raw_str = raw_str
+        # atom, line, spect_nr and spect_name packed as in qtiSet:
+        i -= offset
+        self.fingerprint = raw_str[4:12] + raw_str[i + 4:i + 12]
+
+    @classmethod
+    def record_fingerprint(cls, raw_str):
+        """return fingerprint of the raw record without parsing it"""
+        i = 44 + cls._head_struct.unpack_from(raw_str)[10]
+        return raw_str[4:12] + raw_str[i + 4:i + 12]
+
+    def __repr__(self):
+        return ' '.join([CamecaBase.to_element(self.i_atom),
+                         CamecaBase.to_line(self.i_line),
+                         'overlap with',
+                         CamecaBase.to_element(self.atom),
+                         CamecaBase.to_line(self.line)])
+
+    def __eq__(self, other):
+        return self.raw_str == other.raw_str
+
+    def __hash__(self):
+        return hash(self.raw_str)
+
+    def append_metadata(self, metadata=[]):
+        self.metadata.append(metadata)
+        self.n_metadata += 1
+        self.metadata.sort(key=itemgetter(0))
+        self.oldest = self.metadata[0][0]
+
+    def remove_metadata(self, source):
+        """remove all metadata entries of given source file basename"""
+        self.metadata = [i for i in self.metadata if i[1] != source]
+        self.n_metadata = len(self.metadata)
+        if self.n_metadata > 0:
+            self.oldest = self.metadata[0][0]
+
+    def copy(self):
+        """return shallow copy of the item with its own metadata list,
+        so that aggregation would not modify the parsed original"""
+        item = copy(self)
+        item.metadata = list(self.metadata)
+        return item
+
+    def oldest_newest(self):
+        old_n_new = [self.metadata[0], self.metadata[-1]]
+        a, b, c, d = [item for sublist in old_n_new for item in sublist]
+        thingy = 'oldest: {0} {1}\nnewest: {2} {3}'.format(a, b, c, d)
+        return thingy
+
+    @classmethod
+    def read_from(cls, fn):
+        """read and parse single overlap record from the opened file
+        positioned at the record"""
+        head = fn.read(44)
+        if len(head) < 44:
+            raise IOError('overlap file is truncated')
+        struct_type = struct.unpack_from('<i', head)[0]
+        str_len = struct.unpack_from('<i', head, 40)[0]
+        if str_len < 0:
+            raise ValueError(' '.join(['negative standard name length',
+                                       str(str_len)]))
+        tail_len = str_len + 12
+        if struct_type == 3:
+            tail_len += 8
+        tail = fn.read(tail_len)
+        if len(tail) < tail_len:
+            raise IOError('overlap file is truncated')
+        return cls(head + tail)
+
+
+def iter_overlaps(filename):
+    """yield OverlapItem records of the overlap file one by one,
+    reading it through the buffered file instead of building the full
+    list, so that files of any size are processed in constant memory.
+    The items get the same metadata as in CamecaOverlap."""
+    header = CamecaBase()
+    metadata = [mod_date(filename),
+                os.path.basename(filename).rsplit('.', 1)[0]]
+    with open(filename, 'br') as fn:
+        header._read_the_header(fn)
+        if header.cameca_bin_file_type != 10:
+            raise IOError(' '.join(['The file header shows it is not',
+                                    'overlap file, but',
+                                    header.file_type]))
+        data_type, n_overlaps = struct.unpack('<2i', fn.read(8))
+        if data_type != 0:
+            raise RuntimeError(' '.join(['unexpected value of overlap',
+                                         'struct: instead of expected',
+                                         '0, the value',
+                                         str(data_type)]))
+        for i in range(n_overlaps):
+            item = OverlapItem.read_from(fn)
+            item.append_metadata(list(metadata))
+            yield item
+
+
+class OverlapWriter(object):
+    """streaming counterpart of CamecaOverlap.save_to_file: the header
+    is written at opening, the records as they arrive and the number
+    of overlaps is patched in at closing. The file is written
+    atomically (see AtomicFile); if the context exits with exception
+    the target is left untouched.
+    arguments:
+    filename -- path of the overlap file to write
+    comment -- the file comment (default empty string)
+    version -- the file version (default 3)
+    backups -- number of rotated backups to keep (default 0)
+
+    use as context manager:
+        with OverlapWriter('merged.ovl') as writer:
+            for item in iter_overlaps('big.ovl'):
+                writer.write(item)
+    """
+
+    def __init__(self, filename, comment='', version=3, backups=0):
+        self.filename = filename
+        self.file_comment = comment
+        self.n_overlaps = 0
+        self._atomic = AtomicFile(filename, backups=backups)
+        self.fn = self._atomic.file
+        self.fn.write(CamecaBase._header_bytes(10, version=version,
+                                               comment=comment))
+        self._count_offset = self.fn.tell() + 4
+        self.fn.write(struct.pack('<2i', 0, 0))
+
+    def write(self, overlap):
+        self.fn.write(overlap.raw_str)
+        self.n_overlaps += 1
+
+    def close(self):
+        if self.fn.closed:
+            return
+        try:
+            self.fn.seek(self._count_offset)
+            self.fn.write(struct.pack('<i', self.n_overlaps))
+        except BaseException:
+            self.discard()
+            raise
+        self._atomic.commit()
+
+    def discard(self):
+        self._atomic.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class OverlapColumns(object):
+    """columnar (array backed) presentation store of overlap items.
+    It keeps a typed array per attribute, the string tables for the
+    standard, crystal and file names and all raw records concatenated
+    in a single bytearray, so that the views read the values without
+    touching the OverlapItem objects (which keep changing in the library
+    scanner thread) and the filter scans plain arrays. It is the copy
+    of the items, not the replacement: the OverlapLibrary still keeps
+    its OverlapItem objects.
+    The overlaps are read back as lightweight OverlapColumnsRow views
+    or materialised as the OverlapItem with node method."""
+
+    int_fields = ['struct_type', 'atom', 'line', 'i_atom', 'i_line',
+                  'order', 'offset', 'spect_nr', 'n_metadata']
+    float_fields = ['HV', 'beam_cur', 'peak_bkd', 'dwelltime']
+
+    def __init__(self, overlaps=[]):
+        for name in self.int_fields:
+            setattr(self, name, array('i'))
+        for name in self.float_fields:
+            setattr(self, name, array('f'))
+        # indexes to string tables:
+        self.std_name_id = array('i')
+        self.spect_name_id = array('i')
+        self.oldest_file = array('i')
+        self.newest_file = array('i')
+        # timestamps of oldest and newest metadata:
+        self.oldest_ts = array('d')
+        self.newest_ts = array('d')
+        self.std_names = []
+        self.spect_names = []
+        self.file_names = []
+        # string: index in the table
+        self._std_name_ids = {}
+        self._spect_name_ids = {}
+        self._file_name_ids = {}
+        # raw records:
+        self.raw = bytearray()
+        self.raw_offsets = array('q', [0])
+        for item in overlaps:
+            self.append(item)
+
+    def __len__(self):
+        return len(self.atom)
+
+    def _intern(self, table, lookup, value):
+        if value not in lookup:
+            lookup[value] = len(table)
+            table.append(value)
+        return lookup[value]
+
+    def append(self, item):
+        """append the OverlapItem (with at least one metadata entry)"""
+        for name in self.int_fields:
+            getattr(self, name).append(getattr(item, name))
+        for name in self.float_fields:
+            getattr(self, name).append(getattr(item, name, float('nan')))
+        self.std_name_id.append(self._intern(self.std_names,
+                                             self._std_name_ids,
+                                             item.std_name))
+        self.spect_name_id.append(self._intern(self.spect_names,
+                                               self._spect_name_ids,
+                                               item.spect_name))
+        oldest, newest = item.metadata[0], item.metadata[-1]
+        self.oldest_ts.append(oldest[0].timestamp())
+        self.oldest_file.append(self._intern(self.file_names,
+                                             self._file_name_ids,
+                                             oldest[1]))
+        self.newest_ts.append(newest[0].timestamp())
+        self.newest_file.append(self._intern(self.file_names,
+                                             self._file_name_ids,
+                                             newest[1]))
+        self.raw.extend(item.raw_str)
+        self.raw_offsets.append(len(self.raw))
+
+    def get(self, name, row):
+        """return the value of the OverlapItem attribute for the row"""
+        if name == 'std_name':
+            return self.std_names[self.std_name_id[row]]
+        if name == 'spect_name':
+            return self.spect_names[self.spect_name_id[row]]
+        if name == 'oldest':
+            return datetime.fromtimestamp(self.oldest_ts[row])
+        if name == 'raw_str':
+            return bytes(self.raw[self.raw_offsets[row]:
+                                  self.raw_offsets[row + 1]])
+        if name == 'fingerprint':
+            return self.node(row).fingerprint
+        if name == 'metadata':
+            return self.metadata(row)
+        if (name in self.int_fields) or (name in self.float_fields):
+            return getattr(self, name)[row]
+        raise AttributeError(name)
+
+    def row(self, row):
+        return OverlapColumnsRow(self, row)
+
+    def metadata(self, row):
+        """return oldest and newest metadata entries of the row
+        (the only ones kept by the columns)"""
+        oldest = [datetime.fromtimestamp(self.oldest_ts[row]),
+                  self.file_names[self.oldest_file[row]]]
+        newest = [datetime.fromtimestamp(self.newest_ts[row]),
+                  self.file_names[self.newest_file[row]]]
+        return [oldest, newest]
+
+    def node(self, row):
+        """return the row materialised as the OverlapItem
+        (the metadata is limited to the oldest and newest entries)"""
+        item = OverlapItem(self.get('raw_str', row))
+        oldest, newest = self.metadata(row)
+        item.append_metadata(oldest)
+        if newest != oldest:
+            item.append_metadata(newest)
+        return item
+
+
+class OverlapColumnsRow(object):
+    """read only view of a row in OverlapColumns exposing
+    the same attributes as OverlapItem"""
+    __slots__ = ('_columns', '_row')
+
+    def __init__(self, columns, row):
+        self._columns = columns
+        self._row = row
+
+    def __getattr__(self, name):
+        return self._columns.get(name, self._row)
+
+    def __repr__(self):
+        return OverlapItem.__repr__(self)
+
+    def oldest_newest(self):
+        old_n_new = self._columns.metadata(self._row)
+        a, b, c, d = [item for sublist in old_n_new for item in sublist]
+        thingy = 'oldest: {0} {1}\nnewest: {2} {3}'.format(a, b, c, d)
+        return thingy
+
+
+class OverlapIndex(object):
+    """inverted indexes from the overlap attributes to the row numbers
+    of the overlap list, so that the queries like 'Fe Kα on the
+    spectrometer 3 with LIF' are answered without the full scan.
+    The posting lists are sorted arrays of rows; appending keeps them
+    sorted, removed rows are compacted away in one pass.
+    Indexed keys:
+    atom, i_atom -- measured and overlapping atom number
+    atom_line -- (atom, line) tuple of the measured line
+    spect_nr -- spectrometer number
+    xtal -- basic crystal name (as returned by get_xtal)
+    fingerprint -- fingerprint as used in qtiSet"""
+
+    keys = ('atom', 'i_atom', 'atom_line', 'spect_nr', 'xtal', 'fingerprint')
+
+    def __init__(self, overlaps=[]):
+        # key: {value: array of rows}
+        self.postings = {key: {} for key in self.keys}
+        self.n_rows = 0
+        self.extend(overlaps)
+
+    @staticmethod
+    def _values(item):
+        return (item.atom, item.i_atom, (item.atom, item.line),
+                item.spect_nr, get_xtal(item.spect_name.decode()[::-1]),
+                item.fingerprint)
+
+    def append(self, item):
+        """index the item as the next row"""
+        for key, value in zip(self.keys, self._values(item)):
+            postings = self.postings[key]
+            if value not in postings:
+                postings[value] = array('i')
+            postings[value].append(self.n_rows)
+        self.n_rows += 1
+
+    def extend(self, overlaps):
+        for item in overlaps:
+            self.append(item)
+
+    def remove_rows(self, rows):
+        """drop given rows, renumbering the following ones"""
+        removed = sorted(set(rows))
+        if len(removed) == 0:
+            return
+        drop = set(removed)
+        for postings in self.postings.values():
+            for value in list(postings):
+                kept = array('i', (r - bisect_left(removed, r)
+                                   for r in postings[value]
+                                   if r not in drop))
+                if len(kept) == 0:
+                    del postings[value]
+                else:
+                    postings[value] = kept
+        self.n_rows -= len(removed)
+
+    def copy(self):
+        index = OverlapIndex()
+        index.postings = {key: {value: array('i', rows)
+                                for value, rows in postings.items()}
+                          for key, postings in self.postings.items()}
+        index.n_rows = self.n_rows
+        return index
+
+    def rows(self, **criteria):
+        """return sorted list of rows matching all given criteria.
+        The keyword is the indexed key, the value is either single
+        value or list, set or frozenset of accepted values; criteria
+        with None value are ignored. Example:
+            index.rows(atom_line=(26, 2), spect_nr=3, xtal='LIF')
+        """
+        candidates = []
+        for key, value in criteria.items():
+            if value is None:
+                continue
+            postings = self.postings[key]
+            if not isinstance(value, (list, set, frozenset)):
+                value = [value]
+            matched = [postings[v] for v in value if v in postings]
+            if len(matched) == 1:
+                candidates.append(matched[0])
+            else:
+                candidates.append(sorted(set().union(*matched)))
+        if len(candidates) == 0:
+            return list(range(self.n_rows))
+        # probing the shortest posting list against the rest:
+        candidates.sort(key=len)
+        others = [set(i) for i in candidates[1:]]
+        return [r for r in candidates[0]
+                if all(r in other for other in others)]
+
+    def mask(self, **criteria):
+        """return bytearray with 1 at rows matching the criteria"""
+        mask = bytearray(self.n_rows)
+        for r in self.rows(**criteria):
+            mask[r] = 1
+        return mask
+
+
+def _parse_file(cls, filename):
+    """return cls object (CamecaOverlap or CamecaQtiSetup) of the file
+    or the exception raised while parsing it"""
+    if not os.path.isfile(filename):
+        return IOError(filename + ' got removed')
+    try:
+        return cls(filename)
+    except parse_errors as e:
+        return e
+
+
+def _parse_files(cls, filenames, workers):
+    if (workers <= 1) or (len(filenames) <= 1):
+        return [_parse_file(cls, i) for i in filenames]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(partial(_parse_file, cls), filenames))
+
+
+def parse_overlap_files(filenames, workers=parse_workers):
+    """parse overlap files on the pool of worker threads, what hides
+    the latency of the file reading (i.e. at network shares).
+    arguments:
+    filenames -- list of paths to overlap files
+    workers -- number of worker threads; with 1 or less
+               the files are parsed sequentially (default parse_workers)
+    returns list of CamecaOverlap or exception objects in the same
+    order as the given filenames"""
+    return _parse_files(CamecaOverlap, filenames, workers)
+
+
+def parse_qti_files(filenames, workers=parse_workers):
+    """parse qtiSet files on the pool of worker threads, see
+    parse_overlap_files; returns list of CamecaQtiSetup or exception
+    objects in the same order as the given filenames"""
+    return _parse_files(CamecaQtiSetup, filenames, workers)
+
+
+class _LibraryFile(object):
+    """overlap file as kept by OverlapLibrary after its overlaps got
+    merged: only the raw records (shared with the aggregated items),
+    no OverlapItem objects"""
+    __slots__ = ('file_basename', 'file_modification_date', 'file_comment',
+                 'file_version', 'records')
+
+    def __init__(self, file_basename, file_modification_date,
+                 file_comment, file_version, records):
+        self.file_basename = file_basename
+        self.file_modification_date = file_modification_date
+        self.file_comment = file_comment
+        self.file_version = file_version
+        self.records = records
+
+
+class OverlapLibrary(object):
+    """in-memory index of parsed overlap files in the Overlap directory.
+    Files are tracked by their path and (mtime, size) stat signature,
+    so that at update only added, changed or removed files are
+    (re)parsed and the aggregate of unique overlaps is patched in place
+    instead of rebuilding it from scratch. Only the aggregate holds
+    OverlapItem objects, the files keep just their raw records."""
+
+    # increase at any change of the cache layout or OverlapItem parsing:
+    cache_version = 2
+
+    def __init__(self, overlap_dir, workers=parse_workers):
+        self.overlap_dir = overlap_dir
+        self.workers = workers
+        self.files = {}  # path: [(mtime, size), _LibraryFile]
+        self.fingerprints = None
+        self.aggregate = CamecaOverlap()
+        # inverted indexes to rows of the aggregate:
+        self.index = OverlapIndex()
+        # counters of aggregate changes and of changes of the indexed
+        # files (the filter changes are not counted), and the latter at
+        # the last saving of the cache; consumers compare them with
+        # the values they have seen, so that no change is missed across
+        # updates:
+        self.changes = 0
+        self.file_changes = 0
+        self.saved_changes = 0
+
+    def load_cache(self, cache_file=library_cache_file):
+        """fill the index with the overlap files parsed at the previous
+        run, so that following update reparses only the files changed
+        since then. Outdated, foreign or corrupt cache is ignored
+        (leading to the full scan at update).
+        returns True if cache was used"""
+        if not os.path.isfile(cache_file):
+            return False
+        try:
+            with open(cache_file, 'br') as fn:
+                cache = pickle.load(fn)
+            if (cache['version'] != self.cache_version) or\
+                    (cache['overlap_dir'] !=
+                     os.path.abspath(self.overlap_dir)):
+                return False
+            files = {}
+            for path, entry in cache['files'].items():
+                digest = hashlib.sha1(b''.join(entry['records'])).digest()
+                if digest != entry['sha1']:
+                    raise ValueError('checksum mismatch of ' + path)
+                files[path] = [entry['stamp'], _LibraryFile(
+                    os.path.basename(path).rsplit('.', 1)[0],
+                    entry['modified'], entry['comment'], entry['version'],
+                    entry['records'])]
+        except Exception as e:
+            warnung = ' '.join(['overlap library cache is corrupt (',
+                                repr(e), '), rebuilding it...'])
+            logging.warning(html_colorify(warnung, 'yellow'))
+            return False
+        self.files = files
+        self.aggregate = CamecaOverlap()
+        self.index = OverlapIndex()
+        for path in sorted(self.files):
+            self._merge_records(self.files[path][1])
+        self.changes += 1
+        self.file_changes += 1
+        self.saved_changes = self.file_changes
+        return True
+
+    def save_cache(self, cache_file=library_cache_file):
+        """save raw overlap records of indexed files to the cache file"""
+        files = {}
+        for path, (stamp, library_file) in self.files.items():
+            records = library_file.records
+            files[path] = {'stamp': stamp,
+                           'modified': library_file.file_modification_date,
+                           'comment': library_file.file_comment,
+                           'version': library_file.file_version,
+                           'records': records,
+                           'sha1': hashlib.sha1(b''.join(records)).digest()}
+        cache = {'version': self.cache_version,
+                 'overlap_dir': os.path.abspath(self.overlap_dir),
+                 'files': files}
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            # written to the side and renamed, so that crash would not
+            # leave the half written cache and the running instances
+            # would not write the same file:
+            with AtomicFile(cache_file) as fn:
+                pickle.dump(cache, fn, protocol=pickle.HIGHEST_PROTOCOL)
+            self.saved_changes = self.file_changes
+        except OSError as e:
+            logging.warning(' '.join(['could not save overlap library cache:',
+                                      str(e)]))
+
+    def _merge(self, cam_overlap):
+        """merge overlaps of the freshly parsed file into aggregate
+        (the items are taken over, not copied), return the _LibraryFile
+        of it and the list of newly appended aggregate items"""
+        appended = []
+        records = []
+        for item in cam_overlap.overlaps:
+            raw_str = item.raw_str
+            if (self.fingerprints is None) or\
+                    (item.fingerprint in self.fingerprints):
+                if self.aggregate.append_unique_overlap(item):
+                    self.index.append(item)
+                    appended.append(item)
+                else:
+                    # share the record of the aggregated equivalent:
+                    raw_str = self.aggregate.unique[raw_str].raw_str
+            records.append(raw_str)
+        library_file = _LibraryFile(
+            cam_overlap.file_basename, cam_overlap.file_modification_date,
+            cam_overlap.file_comment, cam_overlap.file_version, records)
+        return library_file, appended
+
+    def _merge_records(self, library_file):
+        """merge raw records of the file into aggregate, parsing only
+        those which are not aggregated yet"""
+        metadata = [library_file.file_modification_date,
+                    library_file.file_basename]
+        if self.aggregate.unique is None:
+            self.aggregate.unique = {}
+        unique = self.aggregate.unique
+        records = library_file.records
+        for i, raw_str in enumerate(records):
+            if (self.fingerprints is not None) and\
+                    (OverlapItem.record_fingerprint(raw_str) not in
+                     self.fingerprints):
+                continue
+            item = unique.get(raw_str)
+            if item is not None:
+                item.append_metadata(metadata)
+                records[i] = item.raw_str
+                continue
+            item = OverlapItem(raw_str)
+            item.append_metadata(metadata)
+            self.aggregate.append_unique_overlap(item)
+            self.index.append(item)
+
+    def _retract(self, library_files):
+        """retract overlaps of the files from the aggregate and
+        the index at once"""
+        removed = self.aggregate.retract_unique_overlaps(
+            [(i.records, i.file_basename) for i in library_files])
+        self.index.remove_rows(removed)
+
+    def update(self, fingerprints=None, batch_callback=None,
+               batch_size=64, progress_callback=None,
+               error_callback=None, cancelled=None):
+        """rescan the overlap directory and patch the aggregate.
+        The files are parsed and merged in batches.
+        fingerprints -- if given, only overlaps with fingerprint in it
+        are aggregated (default None - all overlaps)
+        batch_callback -- if given, it is called after every batch
+                          with the list of overlaps newly appended to
+                          the aggregate (default None)
+        batch_size -- number of files in the batch (default 64)
+        progress_callback -- if given, it is called after every batch
+                             with number of parsed and number of all
+                             files to parse (default None)
+        error_callback -- called with path and exception of the file
+                          which failed to parse (default None - the
+                          warning is logged)
+        cancelled -- if given, it is called before every batch and
+                     if it returns True the update stops; the index is
+                     left consistent, not parsed files are picked
+                     by the next update (default None)
+        returns True if aggregate got changed (the changes counter
+        is then increased; file_changes only if the files did)"""
+        changed = False
+        files_changed = False
+        if fingerprints is not None:
+            fingerprints = frozenset(fingerprints)
+        if fingerprints != self.fingerprints:
+            # the filter changed: rebuild aggregate from parsed files
+            self.fingerprints = fingerprints
+            self.aggregate = CamecaOverlap()
+            self.index = OverlapIndex()
+            for path in sorted(self.files):
+                self._merge_records(self.files[path][1])
+            changed = True
+        present = {}
+        for path in glob(os.path.join(self.overlap_dir, '*.ovl')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed in between
+            present[path] = (st.st_mtime, st.st_size)
+        retracted = []
+        for path in list(self.files):
+            if path not in present:
+                retracted.append(self.files.pop(path)[1])
+        stale = []
+        for path in sorted(present):
+            if path in self.files:
+                if self.files[path][0] == present[path]:
+                    continue
+                retracted.append(self.files.pop(path)[1])
+            stale.append(path)
+        if len(retracted) > 0:
+            self._retract(retracted)
+            changed = True
+            files_changed = True
+        for i in range(0, len(stale), batch_size):
+            if (cancelled is not None) and cancelled():
+                break
+            batch = stale[i:i + batch_size]
+            # parse in parallel, but merge in sorted order to keep
+            # the aggregate deterministic:
+            parsed = parse_overlap_files(batch, workers=self.workers)
+            appended = []
+            for path, cam_overlap in zip(batch, parsed):
+                if isinstance(cam_overlap, Exception):
+                    # most probably file is still being written by
+                    # PeakSight; not recording it, next update will retry
+                    if error_callback is not None:
+                        error_callback(path, cam_overlap)
+                    else:
+                        warnung = ' '.join([path, 'could not be parsed:',
+                                            str(cam_overlap)])
+                        logging.warning(html_colorify(warnung, 'yellow'))
+                    continue
+                library_file, merged = self._merge(cam_overlap)
+                self.files[path] = [present[path], library_file]
+                appended.extend(merged)
+                changed = True
+                files_changed = True
+            if batch_callback is not None:
+                batch_callback(appended)
+            if progress_callback is not None:
+                progress_callback(i + len(batch), len(stale))
+        if changed:
+            self.changes += 1
+        if files_changed:
+            self.file_changes += 1
+        return changed
+
+    def query(self, **criteria):
+        """return the aggregated overlaps matching the criteria,
+        see OverlapIndex.rows"""
+        overlaps = self.aggregate.overlaps
+        return [overlaps[i] for i in self.index.rows(**criteria)]
+
+    def snapshot(self):
+        """return the copy of the aggregate, which is safe to be
+        presented while the library gets updated"""
+        cam_overlaps = CamecaOverlap()
+        cam_overlaps.overlaps = [i.copy() for i in self.aggregate.overlaps]
+        cam_overlaps.n_overlaps = len(cam_overlaps.overlaps)
+        return cam_overlaps
+
+
+class QtiSetupCatalogue(object):
+    """index of all Quanti setups (.qtiSet) in the directory, answering
+    which setups use the fingerprint and which overlaps are not used
+    by any setup. As in OverlapLibrary the files are tracked by their
+    (mtime, size) stat signature, so that at update only added, changed
+    or removed setups are (re)parsed, in parallel."""
+
+    def __init__(self, qti_dir, workers=parse_workers):
+        self.qti_dir = qti_dir
+        self.workers = workers
+        self.setups = {}  # path: [(mtime, size), CamecaQtiSetup]
+        # fingerprint: set of setup basenames using it
+        self.index = {}
+
+    def _add(self, qti_setup):
+        for fingerprint in qti_setup.fingerprint_set:
+            self.index.setdefault(fingerprint,
+                                  set()).add(qti_setup.file_basename)
+
+    def _remove(self, qti_setup):
+        for fingerprint in qti_setup.fingerprint_set:
+            users = self.index[fingerprint]
+            users.discard(qti_setup.file_basename)
+            if len(users) == 0:
+                del self.index[fingerprint]
+
+    def update(self, error_callback=None):
+        """rescan the directory and patch the index.
+        error_callback -- called with path and exception of the file
+                          which failed to parse (default None - the
+                          warning is logged)
+        returns True if the index got changed"""
+        changed = False
+        present = {}
+        for path in glob(os.path.join(self.qti_dir, '*.qtiSet')):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue  # removed in between
+            present[path] = (st.st_mtime, st.st_size)
+        stale = []
+        for path in list(self.setups):
+            if self.setups[path][0] != present.get(path):
+                self._remove(self.setups.pop(path)[1])
+                changed = True
+        for path in sorted(present):
+            if path not in self.setups:
+                stale.append(path)
+        parsed = parse_qti_files(stale, workers=self.workers)
+        for path, qti_setup in zip(stale, parsed):
+            if isinstance(qti_setup, Exception):
+                # most probably locked by PeakSight, next update retries
+                if error_callback is not None:
+                    error_callback(path, qti_setup)
+                else:
+                    warnung = ' '.join([path, 'could not be parsed:',
+                                        str(qti_setup)])
+                    logging.warning(html_colorify(warnung, 'yellow'))
+                continue
+            self.setups[path] = [present[path], qti_setup]
+            self._add(qti_setup)
+            changed = True
+        return changed
+
+    def get(self, basename):
+        """return CamecaQtiSetup of the setup with given basename
+        or None if it is not in the catalogue"""
+        path = os.path.join(self.qti_dir, basename + '.qtiSet')
+        entry = self.setups.get(path)
+        if entry is not None:
+            return entry[1]
+
+    def setups_using(self, fingerprint):
+        """return sorted list of basenames of setups using the
+        fingerprint"""
+        return sorted(self.index.get(fingerprint, ()))
+
+    def orphaned(self, overlaps):
+        """return those of the overlaps (OverlapItem or alike objects)
+        which fingerprint is not used by any setup"""
+        index = self.index
+        return [i for i in overlaps if i.fingerprint not in index]
+
+    def orphaned_in_library(self, library):
+        """return the aggregated overlaps of the OverlapLibrary which
+        fingerprint is not used by any setup (looked up through
+        fingerprint index of the library, not overlap by overlap)"""
+        fingerprints = library.index.postings['fingerprint']
+        return library.query(fingerprint={i for i in fingerprints
+                                          if i not in self.index})
+
+
+def sweep_overlaps(overlaps, fingerprints):
+    """classify overlaps of one file against fingerprints of its setup
+    in one pass over the hashed records.
+    arguments:
+    overlaps -- list of OverlapItem
+    fingerprints -- set of fingerprints used by the setup (i.e.
+                    fingerprint_set of CamecaQtiSetup)
+    returns dictionary with lists of indexes:
+    uncovered -- fingerprint is not used by the setup
+    duplicates -- identical to some preceding overlap
+    conflicts -- same fingerprint and overlapping element as some
+                 preceding overlap, but different parameters"""
+    uncovered, duplicates, conflicts = [], [], []
+    seen_raw = set()
+    seen_keys = set()
+    for i, item in enumerate(overlaps):
+        if item.fingerprint not in fingerprints:
+            uncovered.append(i)
+        elif item.raw_str in seen_raw:
+            duplicates.append(i)
+        elif (item.fingerprint, item.i_atom) in seen_keys:
+            conflicts.append(i)
+        seen_raw.add(item.raw_str)
+        seen_keys.add((item.fingerprint, item.i_atom))
+    return {'uncovered': uncovered, 'duplicates': duplicates,
+            'conflicts': conflicts}
+
+
+def sweep_overlap_dir(qti_dir, prune=False, backups=0,
+                      workers=parse_workers, catalogue=None):
+    """pair every Overlap/*.ovl with its sibling qtiSet setup and find
+    the uncovered and duplicate entries (see sweep_overlaps); with
+    prune they are removed with single atomic write per file.
+    Conflicting entries are only reported, as it is up to the user
+    which of them should be kept.
+    arguments:
+    qti_dir -- the Quanti directory
+    prune -- remove uncovered and duplicate entries (default False)
+    backups -- number of rotated backups of pruned files (default 0)
+    workers -- number of threads parsing and writing the files
+               (default parse_workers)
+    catalogue -- up to date QtiSetupCatalogue of the qti_dir to be
+                 reused (default None - the setups are parsed)
+    returns list of dictionaries, one per overlap file, with path,
+    setup (basename of the setup or None if the file is orphaned),
+    n_overlaps, the index lists of sweep_overlaps, pruned (number
+    of removed entries) and error (message or None)"""
+    if catalogue is None:
+        catalogue = QtiSetupCatalogue(qti_dir, workers=workers)
+        catalogue.update(error_callback=lambda path, e: None)
+    paths = sorted(glob(os.path.join(qti_dir, 'Overlap', '*.ovl')))
+    reports = []
+    to_save = []
+    for path, cam_overlap in zip(paths,
+                                 parse_overlap_files(paths, workers)):
+        basename = os.path.basename(path).rsplit('.', 1)[0]
+        qti_setup = catalogue.get(basename)
+        report = {'path': path, 'setup': None, 'n_overlaps': 0,
+                  'uncovered': [], 'duplicates': [], 'conflicts': [],
+                  'pruned': 0, 'error': None}
+        reports.append(report)
+        if isinstance(cam_overlap, Exception):
+            report['error'] = str(cam_overlap)
+            continue
+        report['n_overlaps'] = cam_overlap.n_overlaps
+        if qti_setup is None:
+            if os.path.isfile(os.path.join(qti_dir, basename + '.qtiSet')):
+                # i.e. locked by PeakSight; not taken for orphaned
+                report['error'] = 'the qtiSet setup could not be parsed'
+            continue  # orphaned file, nothing to compare with
+        report['setup'] = basename
+        report.update(sweep_overlaps(cam_overlap.overlaps,
+                                     qti_setup.fingerprint_set))
+        drop = report['uncovered'] + report['duplicates']
+        if prune and (len(drop) > 0):
+            cam_overlap.remove_overlaps(drop)
+            to_save.append((report, cam_overlap, qti_setup.file_version,
+                            len(drop)))
+
+    def save(entry):
+        report, cam_overlap, version, n_dropped = entry
+        try:
+            cam_overlap.save_to_file(version=version, backups=backups)
+            report['pruned'] = n_dropped
+        except OSError as e:
+            report['error'] = str(e)
+
+    if (workers <= 1) or (len(to_save) <= 1):
+        for entry in to_save:
+            save(entry)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(save, to_save))
+    return reports
@@ -0,0 +1,390 @@
+# Copyright Petras Jokubauskas 2016
+"""Synthetic Cameca PeakSight files for benchmarking, scale testing
+and fuzzing of the parsers without PeakSight: overlap (.ovl, type 10)
+and Quanti setup (.qtiSet, type 4) files in the layout read by the
+cameca module.
+
+examples:
+  write 10000 setups with their overlap files into Quanti directory:
+    python cameca_synth.py Quanti --files 10000
+  only version 4 files, long standard names, every 20th file corrupted:
+    python cameca_synth.py Quanti --file-version 4 --std-name-length 20 40 \\
+        --corrupt-fraction 0.05
+  parse the written overlap files with the reference and the cameca
+  parser and compare the results:
+    python cameca_synth.py Quanti --files 1000 --corrupt-fraction 0.1 --check
+"""
+
+import argparse
+import os
+import random
+import string
+import struct
+import sys
+import time
+from io import BytesIO
+from bisect import bisect
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from cameca import CamecaBase, CamecaOverlap, parse_errors
+
+# basic crystal names as stored (reversed) in the files:
+xtal_names = [b'FIL', b'FILL', b'TEP', b'TEPL', b'PAT', b'0CP', b'1CP']
+
+# relative frequency of elements measured in the geological lab:
+rock_forming_weights = {8: 10, 9: 2, 11: 6, 12: 8, 13: 8, 14: 10,
+                        15: 3, 16: 3, 17: 2, 19: 6, 20: 8, 22: 5,
+                        24: 3, 25: 4, 26: 9, 28: 2, 38: 1, 40: 1,
+                        56: 1, 57: 1, 58: 1}
+
+# relative frequency of measured x-ray lines (cameca line codes):
+line_weights = {2: 12, 1: 1, 15: 4, 14: 1, 20: 2, 19: 1}
+
+_name_chars = string.ascii_letters + string.digits + '_-'
+_words = ['calibration', 'new', 'standard', 'peak', 'position', 'changed',
+          'background', 'recalibrated', 'after', 'service', 'crystal']
+
+
+def header(file_type, version=3, comment='', changes=[]):
+    """return bytes of cameca file header, see CamecaBase._header_bytes"""
+    return CamecaBase._header_bytes(file_type, version=version,
+                                    comment=comment, changes=changes)
+
+
+def fingerprint(atom, line, spect_nr, xtal):
+    """return fingerprint as packed in qtiSet and OverlapItem"""
+    return struct.pack('<3i4s', atom, line, spect_nr, xtal)
+
+
+def overlap_record(atom, line, i_atom, i_line, spect_nr, xtal,
+                   std_name='std', order=1, offset=0, HV=15.0,
+                   beam_cur=20.0, peak_bkd=100.0, struct_type=3,
+                   dwelltime=10.0):
+    """return bytes of the overlap record (see OverlapItem)"""
+    std_name = std_name.encode()
+    data = struct.pack('<7i3fi', struct_type, atom, line, i_atom, i_line,
+                       order, offset, HV, beam_cur, peak_bkd,
+                       len(std_name))
+    data += std_name + struct.pack('<2i4s', 0, spect_nr, xtal)
+    if struct_type == 3:
+        data += struct.pack('<fi', dwelltime, 0)
+    return data
+
+
+def ovl_bytes(records, version=3, comment='', changes=[]):
+    """return bytes of overlap file with given raw records"""
+    return b''.join([header(10, version, comment, changes),
+                     struct.pack('<2i', 0, len(records))] + records)
+
+
+def qti_bytes(options, version=3, comment='', changes=[]):
+    """return bytes of qtiSet with given options, which are lists
+    of the element fingerprints"""
+    parts = [header(4, version, comment, changes), 12 * b'\x00',
+             struct.pack('<i', len(options))]
+    beam = struct.pack('<20i', *range(20))
+    element_tail = 8 * b'\x00' + struct.pack('<i', 0) + 420 * b'\x00'
+    if version == 4:
+        element_tail += 4 * b'\x00'
+    for elements in options:
+        parts.append(32 * b'\x00' + beam + 424 * b'\x00' +
+                     struct.pack('<i', len(elements)))
+        for i in elements:
+            parts.append(i + element_tail)
+    return b''.join(parts)
+
+
+def corrupt(data, rnd):
+    """return the file bytes truncated or with few random bytes
+    overwritten, for fuzzing the parsers"""
+    if rnd.random() < 0.5:
+        return data[:rnd.randrange(len(data))]
+    data = bytearray(data)
+    for i in range(rnd.randint(1, 8)):
+        data[rnd.randrange(len(data))] = rnd.randrange(256)
+    return bytes(data)
+
+
+def reference_overlaps(filename):
+    """parse the overlap file record by record from the stream, the way
+    the original parser did, without any validation of the records.
+    returns list of overlap_fields tuples"""
+    with open(filename, 'br') as fn:
+        fbio = BytesIO(fn.read())
+    base = CamecaBase()
+    base._read_the_header(fbio)
+    if base.cameca_bin_file_type != 10:
+        raise IOError('not overlap file')
+    data_type, n_overlaps = struct.unpack('<2i', fbio.read(8))
+    if data_type != 0:
+        raise RuntimeError('unexpected value of overlap struct')
+    overlaps = []
+    for i in range(n_overlaps):
+        raw_str = fbio.read(44)
+        head = struct.unpack('<7i3fi', raw_str)
+        std_name = fbio.read(head[10])
+        raw_str += std_name
+        spect = fbio.read(12)
+        raw_str += spect
+        spect = struct.unpack('<2i4s', spect)
+        fields = head[:10] + (std_name.decode(),) + spect
+        if head[0] == 3:  # only version 3
+            the_rest = fbio.read(8)
+            raw_str += the_rest
+            fields += struct.unpack('<fi', the_rest)
+        fingerprint = struct.pack('<3i4s', head[1], head[2], spect[1],
+                                  spect[2])
+        overlaps.append(fields + (raw_str, fingerprint))
+    return overlaps
+
+
+def overlap_fields(item):
+    """return tuple of the parsed values of OverlapItem in the order
+    of reference_overlaps"""
+    fields = (item.struct_type, item.atom, item.line, item.i_atom,
+              item.i_line, item.order, item.offset, item.HV, item.beam_cur,
+              item.peak_bkd, item.std_name, item.unknown1, item.spect_nr,
+              item.spect_name)
+    if item.struct_type == 3:
+        fields += (item.dwelltime, item.unknown2)
+    return fields + (item.raw_str, item.fingerprint)
+
+
+def check_parsers(paths):
+    """parse the overlap files with reference_overlaps and CamecaOverlap
+    and compare the results. The cameca parser validates the records,
+    thus it may reject the corrupted file which the reference accepts,
+    but the accepted files have to give identical values.
+    returns dictionary with lists of paths:
+    rejected -- files rejected only by the cameca parser
+    mismatches -- (path, message) of files parsed differently or
+                  failing with other exception than parse_errors"""
+    rejected, mismatches = [], []
+    for path in paths:
+        try:
+            expected = reference_overlaps(path)
+        except Exception as e:
+            expected = e
+        try:
+            parsed = [overlap_fields(i)
+                      for i in CamecaOverlap(path).overlaps]
+        except parse_errors:
+            if not isinstance(expected, Exception):
+                rejected.append(path)
+            continue
+        except Exception as e:
+            mismatches.append((path, 'unexpected ' + repr(e)))
+            continue
+        if isinstance(expected, Exception):
+            mismatches.append((path, 'reference failed with ' +
+                               repr(expected)))
+        # repr, as nan values do not compare equal:
+        elif repr(parsed) != repr(expected):
+            mismatches.append((path, 'parsed values differ'))
+    return {'rejected': rejected, 'mismatches': mismatches}
+
+
+class _WeightedChoice(object):
+    def __init__(self, weights):
+        self.values = list(weights)
+        self.cum_weights = list(accumulate(weights[i] for i in self.values))
+        self.total = self.cum_weights[-1]
+
+    def __call__(self, rnd):
+        return self.values[bisect(self.cum_weights,
+                                  rnd.random() * self.total)]
+
+
+class QuantiTreeGenerator(object):
+    """writer of synthetic Quanti trees; every setup gets its qtiSet
+    file and overlap file of the same basename in Overlap directory.
+    arguments (all optional):
+    seed -- seed of the random generator (default 0)
+    versions -- file versions to pick from (default (3, 4))
+    element_weights -- {atom: weight} of the measured and overlapping
+                       elements (default None - uniform over 3 to 92;
+                       see rock_forming_weights)
+    line_weights -- {cameca line code: weight} (default line_weights)
+    std_name_length -- (min, max) length of standard names (default
+                       (3, 12))
+    changes -- (min, max) number of change log entries (default (0, 3))
+    uncovered_fraction -- fraction of overlaps which fingerprint is left
+                          out of the setup (default 0.1)
+    shared_fraction -- fraction of overlaps drawn from the lab-wide pool,
+                       so that the library aggregation finds the same
+                       overlaps in many files (default 0.5)
+    pool_size -- number of overlaps in the pool (default 2000)
+    corrupt_fraction -- fraction of corrupted files, see corrupt
+                        (default 0.0)
+    mtime_span -- days over which modification times of the files are
+                  spread back from now (default 1000, 0 keeps them)
+    """
+
+    def __init__(self, seed=0, versions=(3, 4), element_weights=None,
+                 line_weights=line_weights, std_name_length=(3, 12),
+                 changes=(0, 3), uncovered_fraction=0.1,
+                 shared_fraction=0.5, pool_size=2000, corrupt_fraction=0.0,
+                 mtime_span=1000):
+        self.rnd = random.Random(seed)
+        self.versions = versions
+        if element_weights is None:
+            element_weights = {i: 1 for i in range(3, 93)}
+        self.atom = _WeightedChoice(element_weights)
+        self.line = _WeightedChoice(line_weights)
+        self.std_name_length = std_name_length
+        self.changes = changes
+        self.uncovered_fraction = uncovered_fraction
+        self.shared_fraction = shared_fraction
+        self.corrupt_fraction = corrupt_fraction
+        self.mtime_span = mtime_span
+        self.now = time.time()
+        self.pool = [self.random_overlap() for i in range(pool_size)]
+
+    def random_name(self):
+        return ''.join(self.rnd.choice(_name_chars) for i in
+                       range(self.rnd.randint(*self.std_name_length)))
+
+    def random_changes(self):
+        rnd = self.rnd
+        return [[datetime(2010, 1, 1) +
+                 timedelta(seconds=rnd.randrange(400000000)),
+                 ' '.join(rnd.sample(_words, rnd.randint(1, 5)))]
+                for i in range(rnd.randint(*self.changes))]
+
+    def random_overlap(self):
+        """return (raw record, fingerprint) of random overlap"""
+        rnd = self.rnd
+        atom, line = self.atom(rnd), self.line(rnd)
+        spect_nr = rnd.randint(1, 5)
+        xtal = rnd.choice(xtal_names).ljust(4, b'\x00')
+        record = overlap_record(
+            atom, line, self.atom(rnd), self.line(rnd), spect_nr, xtal,
+            std_name=self.random_name(), order=rnd.randint(1, 3),
+            offset=rnd.randint(-500, 500), HV=rnd.choice((15.0, 20.0)),
+            beam_cur=rnd.choice((10.0, 20.0, 100.0)),
+            peak_bkd=rnd.uniform(10, 1000),
+            struct_type=rnd.choice((2, 3)),
+            dwelltime=rnd.choice((10.0, 20.0, 40.0)))
+        return record, fingerprint(atom, line, spect_nr, xtal)
+
+    def setup_files(self, n_entries):
+        """return bytes of (overlap file, qtiSet file) of random setup"""
+        rnd = self.rnd
+        records = []
+        fingerprints = []
+        for i in range(n_entries):
+            if rnd.random() < self.shared_fraction:
+                record, fp = rnd.choice(self.pool)
+            else:
+                record, fp = self.random_overlap()
+            records.append(record)
+            if (rnd.random() >= self.uncovered_fraction) and\
+                    (fp not in fingerprints):
+                fingerprints.append(fp)
+        version = rnd.choice(self.versions)
+        # the measured elements spread over one to three options:
+        n_options = rnd.randint(1, 3)
+        options = [fingerprints[i::n_options] for i in range(n_options)]
+        return (ovl_bytes(records, version, self.random_name(),
+                          self.random_changes()),
+                qti_bytes(options, version, self.random_name(),
+                          self.random_changes()))
+
+    def _write(self, path, data):
+        if self.rnd.random() < self.corrupt_fraction:
+            data = corrupt(data, self.rnd)
+        with open(path, 'bw') as fn:
+            fn.write(data)
+        if self.mtime_span > 0:
+            mtime = self.now - self.rnd.random() * self.mtime_span * 86400
+            os.utime(path, (mtime, mtime))
+
+    def write_tree(self, root, n_files=100, n_entries=30):
+        """write n_files setups into root directory.
+        n_entries -- number of overlaps per file, or (min, max) of it
+                     (default 30)
+        returns list of written overlap file paths"""
+        os.makedirs(os.path.join(root, 'Overlap'), exist_ok=True)
+        if isinstance(n_entries, int):
+            n_entries = (n_entries, n_entries)
+        paths = []
+        for n in range(n_files):
+            ovl, qti = self.setup_files(self.rnd.randint(*n_entries))
+            name = 'setup{0:05d}'.format(n)
+            path = os.path.join(root, 'Overlap', name + '.ovl')
+            self._write(path, ovl)
+            self._write(os.path.join(root, name + '.qtiSet'), qti)
+            paths.append(path)
+        return paths
+
+
+def generate_tree(root, n_files=100, n_entries=30, versions=(3, 4),
+                  seed=0, **options):
+    """write Quanti tree with n_files qtiSet setups and overlap files
+    (in Overlap subdirectory) of n_entries overlaps each; other keyword
+    options are passed to QuantiTreeGenerator.
+    returns list of written overlap file paths"""
+    generator = QuantiTreeGenerator(seed=seed, versions=versions,
+                                    **options)
+    return generator.write_tree(root, n_files, n_entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('root', help='Quanti directory to write')
+    parser.add_argument('--files', type=int, default=100,
+                        help='number of setups (default: 100)')
+    parser.add_argument('--entries', type=int, nargs=2, default=[10, 50],
+                        metavar=('MIN', 'MAX'),
+                        help='overlaps per file (default: 10 50)')
+    parser.add_argument('--file-version', type=int, nargs='+',
+                        default=[3, 4], choices=[3, 4],
+                        help='file versions to pick from (default: 3 4)')
+    parser.add_argument('--rock-forming', action='store_true',
+                        help=('draw elements with frequency of geological '
+                              'lab instead of uniformly'))
+    parser.add_argument('--std-name-length', type=int, nargs=2,
+                        default=[3, 12], metavar=('MIN', 'MAX'))
+    parser.add_argument('--changes', type=int, nargs=2, default=[0, 3],
+                        metavar=('MIN', 'MAX'),
+                        help='change log entries per file (default: 0 3)')
+    parser.add_argument('--uncovered-fraction', type=float, default=0.1)
+    parser.add_argument('--shared-fraction', type=float, default=0.5)
+    parser.add_argument('--corrupt-fraction', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', action='store_true',
+                        help=('compare the cameca parser with the reference '
+                              'one on the written overlap files'))
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    paths = generate_tree(
+        args.root, args.files, tuple(args.entries),
+        versions=tuple(args.file_version), seed=args.seed,
+        element_weights=rock_forming_weights if args.rock_forming else None,
+        std_name_length=tuple(args.std_name_length),
+        changes=tuple(args.changes),
+        uncovered_fraction=args.uncovered_fraction,
+        shared_fraction=args.shared_fraction,
+        corrupt_fraction=args.corrupt_fraction)
+    print('{0} setups written in {1:.2f} s'.format(
+        args.files, time.perf_counter() - start), file=sys.stderr)
+    if args.check:
+        report = check_parsers(paths)
+        for path, message in report['mismatches']:
+            print('{0}: {1}'.format(path, message), file=sys.stderr)
+        print('{0} files checked, {1} rejected, {2} mismatches'.format(
+            len(paths), len(report['rejected']),
+            len(report['mismatches'])), file=sys.stderr)
+        # without corruption every file has to be accepted:
+        if (len(report['mismatches']) > 0) or\
+                ((args.corrupt_fraction == 0) and
+                 (len(report['rejected']) > 0)):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -17,6 +17,7 @@ setup(
     name='Cam-overlap-manager',
     version='0.0.1',
     packages=['GUI'],
+    py_modules=['cameca'],
     url='',
     license='GPLv3',
     windows=[{"script": "Cam-overlap-manager.pyw"}],